@@ -1,19 +1,37 @@
 from fastapi import APIRouter, Request, Body
+from fastapi.responses import FileResponse, JSONResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from fastapi.concurrency import run_in_threadpool
 from app.utils.db_selector import select_databases
 from app.utils.schema_extractor import get_dynamic_schema_text
-from app.utils.semantic_selector import select_databases_by_embedding, build_index
-from app.db.multidb_manager import get_db_session, DATABASES
+from app.utils.semantic_selector import (
+    select_databases_by_embedding, select_databases_by_embedding_batch, select_tables_by_embedding, build_index
+)
+from app.db.multidb_manager import cross_db_session, db_session, get_bulkhead, bulkhead_stats, DATABASES
+from app.db.bulkhead import call_all
 from app.utils.config import settings
+from app.utils.result_profiler import profile_rows, digest_to_text
+from app.utils.query_planner import shares_instance, build_cross_db_schema, catalog_name
+from app.utils.workload_capture import StageTimer, capture_enabled, capture_request, context_fingerprint
+from app.utils.llm_scheduler import LLMScheduler, PRIORITY_INTERACTIVE, PRIORITY_SUMMARY, PRIORITY_BATCH
+from app.utils.prompt_builder import SCHEMA_MARKER, build_messages, count_tokens, prompt_budget, truncate_to_tokens
+from app.utils.export_jobs import ExportRejected, check_export, submit_export, get_job, public_status
 from openai import OpenAI
 from datetime import datetime, date
 from decimal import Decimal
-import json, time, uuid, re
+import asyncio, json, os, time, uuid, re
 
 router = APIRouter()
-client = OpenAI(base_url="https://api.groq.com/openai/v1", api_key=settings.groq_api_key)
+# retries are owned by the scheduler, so the client itself never retries
+client = OpenAI(base_url="https://api.groq.com/openai/v1", api_key=settings.groq_api_key, max_retries=0)
+llm = LLMScheduler(
+    client,
+    limits=settings.llm_rate_limits,
+    max_retries=settings.llm_max_retries,
+    backoff_base=settings.llm_backoff_base,
+    backoff_max=settings.llm_backoff_max,
+)
 
 # -------------------- GLOBAL CACHES --------------------
 _schema_cache = {}
@@ -29,19 +47,19 @@ def get_or_create_session(session_id: str | None):
     return session_id, _sessions[session_id]
 
 
-# ✅ --- CHANGED SECTION 1: REDUCED CHAT HISTORY ---
+# ✅ --- CHANGED SECTION 1: TOKEN-BUDGETED CHAT HISTORY ---
 def add_message(session_id: str, role: str, content: str):
     """Append message to a session with trimming."""
     sess = _sessions.setdefault(session_id, {"history": []})
     sess["history"].append({"role": role, "content": content})
-    # Limit memory to 3 user/AI pairs (6 messages) instead of 10
-    sess["history"] = sess["history"][-6:]
+    # Prompts are trimmed by tokens (prompt_builder.fit_history); this only bounds memory per session
+    sess["history"] = sess["history"][-settings.history_max_messages:]
 
 
 # -------------------- SCHEMA CACHE --------------------
 async def get_cached_schema(db_name: str, db: Session, refresh_interval=60):
     now = time.time()
-    schema_data = await run_in_threadpool(get_dynamic_schema_text, db)
+    schema_data = await run_in_threadpool(get_bulkhead(db_name).call, get_dynamic_schema_text, db)
     schema_hash = schema_data["hash"]
 
     if (
@@ -61,8 +79,10 @@ async def get_cached_schema(db_name: str, db: Session, refresh_interval=60):
 
 # -------------------- MERGE LAYER --------------------
 def merge_results_across_dbs(results: dict):
-    if not results or len(results) <= 1:
+    if not results:
         return None
+    if len(results) == 1:  # a single database: its rows are the answer
+        return next(iter(results.values()))["rows"]
     db_columns = [set(row.keys()) for res in results.values() if res["rows"] for row in res["rows"][:1]]
     common_cols = set.intersection(*db_columns) if db_columns else set()
     possible_keys = ["DishName", "DishCode", "DishID", "SupplierName", "ArticleNumber", "CuisineName", "ProductName"]
@@ -117,6 +137,17 @@ You must:
 - Avoid long or robotic sentences.
 """
 
+# Instructions for the conversational summary (sent as the stable system prefix)
+SUMMARY_PROMPT = """
+You are a friendly data analyst assistant.
+Write a short, conversational summary (2–4 sentences) highlighting interesting insights or patterns.
+Avoid being repetitive or robotic. Mention trends or key data points when relevant.
+Example:
+- "Looks like FreshFarm Foods and RiceWorld Traders have the highest ratings this month."
+- "Here’s a quick look at supplier ratings by city — Mumbai and Nagpur are leading!"
+"""
+SUMMARY_MAX_TOKENS = 256  # completion tokens reserved for the summary
+
 # -------------------- SAFE JSON SERIALIZER --------------------
 def safe_jsonify(obj):
     """Recursively convert datetime, date, Decimal to serializable formats."""
@@ -145,75 +176,170 @@ def fix_sql_type_mismatches(sql: str) -> str:
     return sql
 
 
+def fix_sql(sql: str) -> str:
+    """Qualify cross-database table names with dbo and patch known type mismatches."""
+    # `db.table` -> `db.dbo.table`, leaving names that already carry a schema (`db.dbo.table`) alone
+    db_names = {"talk2data", "fooddb", "ordersdb", *DATABASES.keys(), *(catalog_name(n) for n in DATABASES)}
+    pattern = r"\b(" + "|".join(re.escape(n) for n in db_names) + r")\.(?!dbo\.)(?=\w)"
+    sql = re.sub(pattern, r"\1.dbo.", sql, flags=re.IGNORECASE)
+    sql = fix_sql_type_mismatches(sql)
+    return sql
+
+
+# -------------------- QUERY PIPELINE HELPERS --------------------
+IRRELEVANT_KEYWORDS = [
+    "who are you", "who is", "what is your name", "what is a chatbot",
+    "tell me about yourself", "how are you", "who made you", "what can you do"
+]
+
+
+def is_irrelevant_query(query: str) -> bool:
+    return any(k in query.lower() for k in IRRELEVANT_KEYWORDS)
+
+
+def clarification_response(session_id: str, query: str, ve: ValueError):
+    """Info response when the LLM answered with a question/refusal instead of SQL (None otherwise)."""
+    if "I'm here to help" in str(ve) or "Which data" in str(ve):
+        clarification_msg = str(ve)
+        add_message(session_id, "user", query)
+        add_message(session_id, "assistant", clarification_msg)
+        return {
+            "status": "info",
+            "message": clarification_msg,
+            "session_id": session_id
+        }
+    return None
+
+
+async def generate_sql(db_name: str, schema_text: str, query: str, history: list, priority: int = PRIORITY_INTERACTIVE):
+    """Ask the LLM for a SQL query against one database. Returns (sql, tokens, queue_wait_ms, prompt_tokens)."""
+    model = "llama-3.3-70b-versatile"
+    # Stable prefix (instructions + schema) first so the provider can reuse it across turns;
+    # the per-turn history and question come last
+    messages, prompt_stats = build_messages(
+        model,
+        prefix=f"{SYSTEM_PROMPT}\nDatabase: {db_name}\n{SCHEMA_MARKER}\n{schema_text}",
+        question=f"User: {query}",
+        history=history,
+    )
+
+    completion, llm_stats = await llm.chat(
+        model=model,
+        messages=messages,
+        priority=priority,
+        temperature=0.3,
+    )
+    tokens = completion.usage.total_tokens if completion.usage else 0
+
+    sql_query = (
+        completion.choices[0].message.content
+        .replace("```sql", "").replace("```", "").strip()
+    )
+    return " ".join(sql_query.split()), tokens, llm_stats["queue_wait_ms"], prompt_stats["total"]
+
+
+def execute_sql(db: Session, sql_query: str):
+    """Run generated SQL (blocking). Raises ValueError when the LLM did not return a SELECT."""
+    if "I'm here to help" in sql_query or not sql_query.lower().startswith("select"):
+        raise ValueError(sql_query)
+
+    fixed_sql = fix_sql(sql_query)
+    result = db.execute(text(fixed_sql))
+    return (result.fetchall() if result.returns_rows else []), fixed_sql
+
+
 # ✅ --- CHANGED SECTION 3: TOKEN-EFFICIENT HUMAN RESPONSE ---
-async def generate_human_response(query, merged_results, session_id=None):
-    """Generate a natural, conversational response summarizing the query result."""
+async def generate_human_response(query, merged_results, session_id=None, raw_rows=None):
+    """
+    Generate a natural, conversational response summarizing the query result.
+    `raw_rows` are the SQLAlchemy rows behind a single-source result; profiling them
+    column by column skips the per-row dicts.
+    """
     if not merged_results:
-        return ("I couldn’t find matching records for that query. Would you like to refine it?", 0)
+        return ("I couldn’t find matching records for that query. Would you like to refine it?", 0, 0.0, 0)
 
     # OLD way sent 5 full rows of JSON, which was very token-heavy
     # sample = json.dumps(safe_jsonify(merged_results[:5]), indent=2)
 
-    # NEW: Send only headers and the first row for lightweight context
-    sample_data = safe_jsonify(merged_results)
-    headers = list(sample_data[0].keys()) if sample_data else []
-    first_row = list(sample_data[0].values()) if sample_data else []
-    
-    sample = f"Columns: {', '.join(headers)}\nFirst Row Example: {', '.join(map(str, first_row))}"
+    # NEWER: a fixed-size statistical digest of the *whole* result plus one example row,
+    # instead of serializing every row just to read the first one
+    if raw_rows:
+        digest = await run_in_threadpool(profile_rows, raw_rows, columns=list(raw_rows[0]._fields))
+    else:
+        digest = await run_in_threadpool(profile_rows, merged_results)
+    first_row = safe_jsonify(merged_results[0])
+    example = ", ".join(f"{k}={str(v)[:40]}" for k, v in first_row.items() if not str(k).startswith("_"))
+
+    sample = f"{digest_to_text(digest)}\nFirst Row Example: {example}"
 
     context = ""
     if session_id and len(_sessions.get(session_id, {}).get("history", [])) > 2:
         context = "Continue the discussion naturally based on our earlier conversation.\n"
 
-    prompt = f"""
-    You are a friendly data analyst assistant.
-    {context}
-    The user asked: "{query}"
-    
-    Here are the columns and one example row from the result:
-    {sample}
-
-    Write a short, conversational summary (2–4 sentences) highlighting interesting insights or patterns.
-    Avoid being repetitive or robotic. Mention trends or key data points when relevant.
-    Example:
-    - "Looks like FreshFarm Foods and RiceWorld Traders have the highest ratings this month."
-    - "Here’s a quick look at supplier ratings by city — Mumbai and Nagpur are leading!"
-    """
+    model = "llama3-8b-8192"
+    # fixed instructions are the (cacheable) prefix; the digest is capped to what the budget leaves
+    sample_budget = prompt_budget(model) - count_tokens(SUMMARY_PROMPT) - count_tokens(query) - 2 * SUMMARY_MAX_TOKENS
+    prompt = f"""{context}The user asked: "{query}"
+
+Here is a statistical digest of the full result and one example row:
+{truncate_to_tokens(sample, max(sample_budget, 200))}"""
+    messages, prompt_stats = build_messages(model, prefix=SUMMARY_PROMPT, question=prompt, reserve_tokens=SUMMARY_MAX_TOKENS)
 
     try:
-        completion = await run_in_threadpool(lambda: client.chat.completions.create(
+        completion, llm_stats = await llm.chat(
             # ✅ CHANGED to a smaller, faster model for summarization
-            model="llama3-8b-8192",
-            messages=[{"role": "user", "content": prompt}],
+            model=model,
+            messages=messages,
+            priority=PRIORITY_SUMMARY,
             temperature=0.65,
-        ))
+            max_tokens=SUMMARY_MAX_TOKENS,
+        )
         #return completion.choices[0].message.content.strip()
         text = completion.choices[0].message.content.strip()
         tokens = completion.usage.total_tokens if completion.usage else 0
-        return (text, tokens)
+        return (text, tokens, llm_stats["queue_wait_ms"], prompt_stats["total"])
     except Exception:
-        return ("Here's your data summary.", 0)
+        return ("Here's your data summary.", 0, 0.0, prompt_stats["total"])
 
 
 @router.post("/multi-db-query")
 async def multi_db_query(payload: dict = Body(...), request: Request = None):
+    trace = {"ts": time.time(), "timer": StageTimer()}
+    response = await answer_query(payload, trace)
+    capture_request(payload, trace, response)
+    return response
+
+
+async def answer_query(payload: dict, trace: dict):
+    """Full question -> SQL -> answer pipeline. Stage timings and token usage are written into `trace`."""
+    timer = trace["timer"]
     try:
         query = payload.get("query", "").strip()
         session_id = payload.get("session_id")
         session_id, session = get_or_create_session(session_id)
+        if capture_enabled():
+            trace["context"] = context_fingerprint(session["history"])
 
         # Dictionary to store token counts
         total_token_usage = {
            "sql_generation": 0,
            "human_response": 0
         }
+        trace["tokens"] = total_token_usage
+        # Prompt size per stage as assembled (before the call), to watch budgets and history growth
+        prompt_tokens = {
+            "sql_generation": 0,
+            "human_response": 0
+        }
+        trace["prompt_tokens"] = prompt_tokens
+        # Time spent waiting in the LLM scheduler queue (ms)
+        llm_queue_wait = {
+            "sql_generation": 0.0,
+            "human_response": 0.0
+        }
 
         # 🧠 Step 1: Block irrelevant / non-data questions
-        irrelevant_keywords = [
-            "who are you", "who is", "what is your name", "what is a chatbot",
-            "tell me about yourself", "how are you", "who made you", "what can you do"
-        ]
-        if any(k in query.lower() for k in irrelevant_keywords):
+        if is_irrelevant_query(query):
             return {
                 "status": "info",
                 "message": (
@@ -224,99 +350,121 @@ async def multi_db_query(payload: dict = Body(...), request: Request = None):
             }
 
         # ✅ CHANGED to use the 5-minute cache, removed force=True
-        build_index()
-        selected_dbs = select_databases_by_embedding(query)
+        # index building reflects every database, so keep it off the event loop
+        with timer.stage("selection"):
+            await run_in_threadpool(build_index)
+            selected_dbs = await run_in_threadpool(select_databases_by_embedding, query)
         if not selected_dbs:
             return {"status": "error", "message": "No relevant database found.", "session_id": session_id}
 
         results = {}
-
-        # 🧩 Step 2: Process each relevant database
-        for db_name in selected_dbs:
-            session_gen = get_db_session(db_name)
-            db = next(session_gen)
-            schema_info = await get_cached_schema(db_name, db)
-            schema_text = schema_info["text"]
-
-            # 🧠 Step 3: Combine history with new query for contextual reasoning
-            history = session["history"]
-            previous_context = "\n".join([f"{m['role']}: {m['content']}" for m in history])
-
-            messages = [
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "assistant", "content": f"Previous context:\n{previous_context}"},
-                {"role": "user", "content": f"Database: {db_name}\nSchema:\n{schema_text}\n\nUser: {query}"}
-            ]
-
-            # 🧩 Step 4: Generate SQL query
-            completion = await run_in_threadpool(lambda: client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
-                messages=messages,
-                temperature=0.3,
-            ))
-            
-            # Capture SQL generation tokens
-            if completion.usage:
-                total_token_usage["sql_generation"] += completion.usage.total_tokens
-
-            sql_query = (
-                completion.choices[0].message.content
-                .replace("```sql", "").replace("```", "").strip()
-            )
-            sql_query = " ".join(sql_query.split())
-
-            # 🧩 Step 5: Execute SQL safely
-            def execute_query():
-                if "I'm here to help" in sql_query or not sql_query.lower().startswith("select"):
-                    raise ValueError(sql_query)
-
-                def fix_sql(sql):
-                    sql = sql.replace("talk2data.", "talk2data.dbo.").replace("fooddb.", "fooddb.dbo.")
-                    sql = sql.replace("ordersdb.", "ordersdb.dbo.")
-                    sql = fix_sql_type_mismatches(sql)
-                    return sql
-                
-                fixed_sql = fix_sql(sql_query)
-                result = db.execute(text(fixed_sql))
-                return (result.fetchall() if result.returns_rows else []), fixed_sql
-
-            # Handle clarification questions
+        merged_output = None
+        raw_rows = None  # rows behind merged_output when it comes from a single query
+        query_plan = "per_db"
+
+        # 🧩 Step 2a: Databases on the same SQL Server instance -> one cross-database query,
+        # joined server-side instead of merging full row sets in Python
+        if shares_instance(selected_dbs):
+            plan_label = "+".join(selected_dbs)
             try:
-                rows, executed_sql = await run_in_threadpool(execute_query)
+                schemas = {}
+                with timer.stage("schema"):
+                    for db_name in selected_dbs:
+                        async with db_session(db_name) as db:
+                            schemas[db_name] = await get_cached_schema(db_name, db)
+                    table_hits = await run_in_threadpool(select_tables_by_embedding, query, selected_dbs)
+                    schema_text = build_cross_db_schema(schemas, table_hits)
+
+                with timer.stage("sql_generation"):
+                    sql_query, sql_tokens, queue_wait, sql_prompt_tokens = await generate_sql(
+                        f"{', '.join(catalog_name(n) for n in selected_dbs)} (same SQL Server instance)",
+                        schema_text, query, session["history"]
+                    )
+                total_token_usage["sql_generation"] += sql_tokens
+                prompt_tokens["sql_generation"] += sql_prompt_tokens
+                llm_queue_wait["sql_generation"] += queue_wait
+
+                # three-part names resolve from any database on the instance; the query still
+                # loads every selected database, so it holds (and reports to) each one's bulkhead
+                with timer.stage("execution"):
+                    async with cross_db_session(selected_dbs) as db:
+                        bulkheads = [get_bulkhead(n) for n in selected_dbs]
+                        rows, executed_sql = await run_in_threadpool(call_all, bulkheads, execute_sql, db, sql_query)
+
+                formatted = [safe_jsonify(dict(row._mapping)) for row in rows]
+                results[plan_label] = {
+                    "generated_sql": executed_sql,
+                    "rows": formatted,
+                    "rows_returned": len(formatted),
+                    "schema_version": "+".join(schemas[n]["hash"][:8] for n in selected_dbs),
+                }
+                merged_output = formatted
+                raw_rows = rows
+                query_plan = "cross_db"
+
+                add_message(session_id, "user", query)
+                add_message(session_id, "assistant", "Data retrieved successfully.")
             except ValueError as ve:
-                if "I'm here to help" in str(ve) or "Which data" in str(ve):
-                    clarification_msg = str(ve)
-                    add_message(session_id, "user", query)
-                    add_message(session_id, "assistant", clarification_msg)
-                    return {
-                        "status": "info",
-                        "message": clarification_msg,
-                        "session_id": session_id
-                    }
-                else:
+                clarification = clarification_response(session_id, query, ve)
+                if clarification:
+                    return clarification
+                print(f"[⚠️] Cross-database plan failed, falling back to per-database queries: {ve}")
+            except Exception as ex:
+                print(f"[⚠️] Cross-database plan failed, falling back to per-database queries: {ex}")
+
+        # 🧩 Step 2b: Otherwise process each relevant database separately
+        if query_plan == "per_db":
+            for db_name in selected_dbs:
+                # DB slots are held only around DB work, not while waiting on the LLM
+                with timer.stage("schema"):
+                    async with db_session(db_name) as db:
+                        schema_info = await get_cached_schema(db_name, db)
+                schema_text = schema_info["text"]
+
+                # 🧩 Step 3-4: Generate SQL with the conversation history as context
+                with timer.stage("sql_generation"):
+                    sql_query, sql_tokens, queue_wait, sql_prompt_tokens = await generate_sql(db_name, schema_text, query, session["history"])
+                total_token_usage["sql_generation"] += sql_tokens
+                prompt_tokens["sql_generation"] += sql_prompt_tokens
+                llm_queue_wait["sql_generation"] += queue_wait
+
+                # 🧩 Step 5: Execute SQL safely
+                # Handle clarification questions
+                try:
+                    with timer.stage("execution"):
+                        async with db_session(db_name) as db:
+                            rows, executed_sql = await run_in_threadpool(get_bulkhead(db_name).call, execute_sql, db, sql_query)
+                except ValueError as ve:
+                    clarification = clarification_response(session_id, query, ve)
+                    if clarification:
+                        return clarification
                     raise ve
 
-            formatted = [safe_jsonify(dict(row._mapping)) for row in rows]
-            
-            # 🧠 Summarize for memory
-            summary = "Data retrieved successfully."
-            add_message(session_id, "user", query)
-            add_message(session_id, "assistant", summary)
+                formatted = [safe_jsonify(dict(row._mapping)) for row in rows]
+                raw_rows = rows  # only used when this turns out to be the only database
 
-            results[db_name] = {
-                "generated_sql": executed_sql,
-                "rows": formatted,
-                "rows_returned": len(formatted),
-                "schema_version": schema_info["hash"][:8],
-            }
-            db.close()
+                # 🧠 Summarize for memory
+                summary = "Data retrieved successfully."
+                add_message(session_id, "user", query)
+                add_message(session_id, "assistant", summary)
+
+                results[db_name] = {
+                    "generated_sql": executed_sql,
+                    "rows": formatted,
+                    "rows_returned": len(formatted),
+                    "schema_version": schema_info["hash"][:8],
+                }
+
+            merged_output = merge_results_across_dbs(results)
+            if len(results) > 1:
+                raw_rows = None  # the digest must describe the merged rows
 
-        merged_output = merge_results_across_dbs(results)
-        
         if all(len(v["rows"]) == 0 for v in results.values()):
             
             # ✅ PRINT to terminal here
             print(f"[📊 TOKEN USAGE] SQL: {total_token_usage['sql_generation']}, Response: 0, Total: {total_token_usage['sql_generation']}")
+            print(f"[⏱️ LLM QUEUE WAIT] SQL: {llm_queue_wait['sql_generation']:.0f}ms")
+            print(f"[🧾 PROMPT TOKENS] SQL: {prompt_tokens['sql_generation']}")
             
             return {
                 "status": "success",
@@ -325,18 +473,25 @@ async def multi_db_query(payload: dict = Body(...), request: Request = None):
                 "results": results,
                 "merged_results": [],
                 "merge_reasoning": "No matching records.",
+                "query_plan": query_plan,
                 "session_id": session_id,
                 "human_response": "I couldn’t find any matching records for that request. Maybe try a different filter or column?",
+                "llm_queue_wait_ms": llm_queue_wait,
                 # ❌ "token_usage" key is REMOVED
             }
 
         # 💬 Generate conversational response
-        human_response, response_tokens = await generate_human_response(query, merged_output, session_id)
+        with timer.stage("summary"):
+            human_response, response_tokens, queue_wait, summary_prompt_tokens = await generate_human_response(query, merged_output, session_id, raw_rows)
         total_token_usage["human_response"] = response_tokens
+        prompt_tokens["human_response"] = summary_prompt_tokens
+        llm_queue_wait["human_response"] = queue_wait
 
         # ✅ PRINT to terminal here
         total = total_token_usage['sql_generation'] + total_token_usage['human_response']
         print(f"[📊 TOKEN USAGE] SQL: {total_token_usage['sql_generation']}, Response: {total_token_usage['human_response']}, Total: {total}")
+        print(f"[⏱️ LLM QUEUE WAIT] SQL: {llm_queue_wait['sql_generation']:.0f}ms, Response: {llm_queue_wait['human_response']:.0f}ms")
+        print(f"[🧾 PROMPT TOKENS] SQL: {prompt_tokens['sql_generation']}, Response: {prompt_tokens['human_response']}")
 
         return {
             "status": "success",
@@ -344,11 +499,235 @@ async def multi_db_query(payload: dict = Body(...), request: Request = None):
             "selected_databases": selected_dbs,
             "results": results,
             "merged_results": merged_output or [],
-            "merge_reasoning": "(auto-merged successfully)",
+            "merge_reasoning": "(joined server-side in one cross-database query)" if query_plan == "cross_db" else "(auto-merged successfully)",
+            "query_plan": query_plan,
             "session_id": session_id,
             "human_response": human_response,
+            "llm_queue_wait_ms": llm_queue_wait,
             # ❌ "token_usage" key is REMOVED
         }
 
     except Exception as e:
-        return {"status": "error", "message": str(e), "type": type(e).__name__, "session_id": locals().get("session_id")}
\ No newline at end of file
+        return {"status": "error", "message": str(e), "type": type(e).__name__, "session_id": locals().get("session_id")}
+
+
+# -------------------- BATCH QUERY --------------------
+@router.post("/multi-db-query/batch")
+async def multi_db_query_batch(payload: dict = Body(...)):
+    """
+    Answer a list of independent questions in one call.
+    Questions are embedded together, grouped by selected database so each schema is
+    fetched once, and SQL generation + execution runs under a bounded concurrency limit.
+    Results come back in input order with per-item errors; no conversational summary is generated.
+    """
+    started = time.perf_counter()
+    try:
+        queries = payload.get("queries")
+        if not isinstance(queries, list) or not all(isinstance(q, str) for q in queries):
+            return {"status": "error", "message": "'queries' must be a list of question strings."}
+        queries = [q.strip() for q in queries]
+        if not queries:
+            return {"status": "error", "message": "No queries provided."}
+        if len(queries) > settings.batch_max_questions:
+            return {"status": "error", "message": f"Batch too large (max {settings.batch_max_questions} queries)."}
+
+        max_concurrency = int(payload.get("max_concurrency") or settings.batch_max_concurrency)
+        max_concurrency = max(1, min(max_concurrency, settings.batch_max_concurrency))
+
+        items = [
+            {"index": i, "input": q, "status": "success", "selected_databases": [], "results": {}, "errors": {}}
+            for i, q in enumerate(queries)
+        ]
+        pending = []
+        for item in items:
+            if not item["input"]:
+                item.update(status="error", message="Empty query.")
+            elif is_irrelevant_query(item["input"]):
+                item.update(status="info", message="I'm here to help you analyze and query data. Please ask a data-related question.")
+            else:
+                pending.append(item)
+
+        # 🧠 Step 1: One embedding call for every question
+        await run_in_threadpool(build_index)
+        selections = await run_in_threadpool(select_databases_by_embedding_batch, [item["input"] for item in pending])
+
+        # 🧩 Step 2: Group questions by database so each schema is fetched once
+        by_db = {}
+        for item, dbs in zip(pending, selections):
+            item["selected_databases"] = dbs
+            if not dbs:
+                item.update(status="error", message="No relevant database found.")
+            for db_name in dbs:
+                by_db.setdefault(db_name, []).append(item)
+
+        schemas = {}
+        for db_name, db_items in by_db.items():
+            try:
+                async with db_session(db_name) as db:
+                    schemas[db_name] = await get_cached_schema(db_name, db)
+            except Exception as e:
+                for item in db_items:
+                    item["errors"][db_name] = f"{type(e).__name__}: {e}"
+
+        # 🧩 Step 3: Generate + execute SQL per (question, database) under a concurrency cap
+        semaphore = asyncio.Semaphore(max_concurrency)
+        token_usage = {"sql_generation": 0, "sql_prompt": 0}
+
+        async def run_one(item, db_name):
+            schema_info = schemas[db_name]
+            async with semaphore:
+                sql_query, sql_tokens, queue_wait, sql_prompt_tokens = await generate_sql(
+                    db_name, schema_info["text"], item["input"], [], priority=PRIORITY_BATCH
+                )
+                token_usage["sql_generation"] += sql_tokens
+                token_usage["sql_prompt"] += sql_prompt_tokens
+                item["llm_queue_wait_ms"] = item.get("llm_queue_wait_ms", 0.0) + queue_wait
+
+                async with db_session(db_name) as db:
+                    rows, executed_sql = await run_in_threadpool(get_bulkhead(db_name).call, execute_sql, db, sql_query)
+
+            formatted = [safe_jsonify(dict(row._mapping)) for row in rows]
+            item["results"][db_name] = {
+                "generated_sql": executed_sql,
+                "rows": formatted,
+                "rows_returned": len(formatted),
+                "schema_version": schema_info["hash"][:8],
+            }
+
+        async def run_guarded(item, db_name):
+            try:
+                await run_one(item, db_name)
+            except Exception as e:
+                item["errors"][db_name] = f"{type(e).__name__}: {e}"
+
+        await asyncio.gather(*[
+            run_guarded(item, db_name)
+            for db_name, db_items in by_db.items() if db_name in schemas
+            for item in db_items
+        ])
+
+        # 🧩 Step 4: Assemble per-question output in input order
+        for item in pending:
+            if item["status"] != "success":
+                continue
+            if not item["results"]:
+                item.update(status="error", message="; ".join(f"{db}: {err}" for db, err in item["errors"].items()))
+                continue
+            item["merged_results"] = merge_results_across_dbs(item["results"]) or []
+
+        elapsed = time.perf_counter() - started
+        print(f"[📦 BATCH] {len(queries)} queries, {len(by_db)} databases, {elapsed:.2f}s, SQL tokens: {token_usage['sql_generation']}")
+
+        return {
+            "status": "success",
+            "items": items,
+            "stats": {
+                "queries": len(queries),
+                "databases": len(by_db),
+                "max_concurrency": max_concurrency,
+                "elapsed_seconds": round(elapsed, 3),
+                "sql_generation_tokens": token_usage["sql_generation"],
+                "sql_prompt_tokens": token_usage["sql_prompt"],
+            },
+        }
+
+    except Exception as e:
+        return {"status": "error", "message": str(e), "type": type(e).__name__}
+
+
+# -------------------- RESULT EXPORT --------------------
+def validate_export_sql(sql_query: str) -> str:
+    """Same SELECT-only check as execute_sql, without running anything. Returns the fixed SQL."""
+    if "I'm here to help" in sql_query or not sql_query.lower().startswith("select"):
+        raise ValueError(sql_query)
+    return fix_sql(sql_query)
+
+
+@router.post("/multi-db-query/export")
+async def export_query(payload: dict = Body(...)):
+    """
+    Export the full result of a question as a background job (Parquet or gzip CSV).
+    Payload: {"query": ..., "format": "parquet" | "csv", "database": optional, "session_id": optional}.
+    SQL is generated as for /multi-db-query (one job per selected database); rows are then
+    streamed to a file instead of being returned. Poll /multi-db-query/export/{job_id}.
+    """
+    try:
+        query = payload.get("query", "").strip()
+        fmt = payload.get("format") or "parquet"
+        session_id, session = get_or_create_session(payload.get("session_id"))
+        if not query:
+            return {"status": "error", "message": "Empty query.", "session_id": session_id}
+        if is_irrelevant_query(query):
+            return {"status": "info", "message": "I'm here to help you analyze and query data. Please ask a data-related question.",
+                    "session_id": session_id}
+
+        if payload.get("database"):
+            if payload["database"] not in DATABASES:
+                return {"status": "error", "message": f"Database '{payload['database']}' not configured.", "session_id": session_id}
+            selected_dbs = [payload["database"]]
+        else:
+            await run_in_threadpool(build_index)
+            selected_dbs = await run_in_threadpool(select_databases_by_embedding, query)
+        if not selected_dbs:
+            return {"status": "error", "message": "No relevant database found.", "session_id": session_id}
+        # format and job/disk limits are checked before any SQL is generated
+        fmt = await run_in_threadpool(check_export, fmt, len(selected_dbs))
+
+        jobs, errors = [], {}
+        for db_name in selected_dbs:
+            try:
+                async with db_session(db_name) as db:
+                    schema_info = await get_cached_schema(db_name, db)
+                sql_query, _, _, _ = await generate_sql(db_name, schema_info["text"], query, session["history"])
+                try:
+                    export_sql = validate_export_sql(sql_query)
+                except ValueError as ve:
+                    clarification = clarification_response(session_id, query, ve)
+                    if clarification:
+                        return clarification
+                    raise
+                job = await run_in_threadpool(submit_export, db_name, export_sql, fmt)
+                jobs.append({**public_status(job), "status_url": f"/api/multi-db-query/export/{job['job_id']}"})
+            except ExportRejected as ex:
+                return {"status": "error", "message": str(ex), "jobs": jobs, "session_id": session_id}
+            except Exception as ex:
+                errors[db_name] = f"{type(ex).__name__}: {ex}"
+
+        if not jobs:
+            return {"status": "error", "message": "; ".join(f"{db}: {err}" for db, err in errors.items()), "session_id": session_id}
+        return {"status": "success", "input": query, "jobs": jobs, "errors": errors, "session_id": session_id}
+
+    except ExportRejected as ex:
+        return {"status": "error", "message": str(ex), "session_id": session_id}
+    except Exception as e:
+        return {"status": "error", "message": str(e), "type": type(e).__name__}
+
+
+@router.get("/multi-db-query/export/{job_id}")
+async def export_status(job_id: str):
+    """Progress of an export job: status, rows and bytes written so far, and the download link when done."""
+    job = get_job(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"status": "error", "message": "Unknown export job."})
+    status = public_status(job)
+    if job["status"] == "done":
+        status["download_url"] = f"/api/multi-db-query/export/{job_id}/download"
+    return {"status": "success", "job": status}
+
+
+@router.get("/multi-db-query/export/{job_id}/download")
+async def export_download(job_id: str):
+    job = get_job(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"status": "error", "message": "Unknown export job."})
+    if job["status"] != "done":
+        return JSONResponse(status_code=409, content={"status": "error", "message": f"Export is {job['status']}."})
+    media_type = "application/vnd.apache.parquet" if job["format"] == "parquet" else "application/gzip"
+    return FileResponse(job["path"], media_type=media_type, filename=os.path.basename(job["path"]))
+
+
+# -------------------- DATABASE HEALTH --------------------
+@router.get("/db-health")
+async def db_health():
+    """Per-database bulkhead state: in-flight, queue depth, rejections and circuit breaker state."""
+    return {"status": "success", "databases": bulkhead_stats()}
@@ -0,0 +1,217 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from sqlalchemy import exc as sa_exc
+
+
+class DatabaseUnavailable(Exception):
+    """Raised when a database's bulkhead rejects work (queue full/timed out or circuit open)."""
+
+
+def is_health_failure(exc: Exception) -> bool:
+    """True for errors that say something about the database itself (not about the generated SQL)."""
+    if isinstance(exc, (sa_exc.OperationalError, sa_exc.InterfaceError, sa_exc.TimeoutError, TimeoutError)):
+        return True
+    return isinstance(exc, sa_exc.DBAPIError) and exc.connection_invalidated
+
+
+# -------------------------------------------------------------------
+# CIRCUIT BREAKER
+# -------------------------------------------------------------------
+class CircuitBreaker:
+    """
+    Opens when the recent failure/slow-call rate crosses a threshold, fails fast while
+    open, then lets a single trial call through (half-open) before closing again.
+    """
+
+    def __init__(self, window: int = 20, min_calls: int = 5, failure_rate_threshold: float = 0.5,
+                 slow_call_seconds: float = 10.0, open_seconds: float = 30.0):
+        self.window = deque(maxlen=window)  # True for failed or slow calls
+        self.min_calls = min_calls
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.trial_started = None  # set while the half-open trial call is outstanding
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            now = time.monotonic()
+            if self.state == "open" and now - self.opened_at >= self.open_seconds:
+                self.state = "half_open"
+                self.trial_started = None
+            # a trial that never reported back (e.g. rejected by the queue) expires after open_seconds
+            if self.state == "half_open" and (
+                self.trial_started is None or now - self.trial_started >= self.open_seconds
+            ):
+                self.trial_started = now
+                return True
+            return False
+
+    def record(self, ok: bool, latency: float):
+        bad = not ok or latency >= self.slow_call_seconds
+        with self._lock:
+            if self.state == "half_open":
+                self.trial_started = None
+                if bad:
+                    self._open()
+                else:
+                    self.state = "closed"
+                    self.window.clear()
+                return
+            self.window.append(bad)
+            if len(self.window) >= self.min_calls and self.bad_rate() >= self.failure_rate_threshold:
+                self._open()
+
+    def bad_rate(self) -> float:
+        return sum(self.window) / len(self.window) if self.window else 0.0
+
+    def _open(self):
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.window.clear()
+
+
+# -------------------------------------------------------------------
+# BULKHEAD
+# -------------------------------------------------------------------
+class _Waiter:
+    __slots__ = ("granted", "event", "loop", "future")
+
+    def __init__(self, event=None, loop=None, future=None):
+        self.granted = False
+        self.event = event
+        self.loop = loop
+        self.future = future
+
+    def wake(self):
+        if self.event is not None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class Bulkhead:
+    """
+    Per-database concurrency cap with a bounded FIFO queue.
+    Usable from worker threads (acquire) and from the event loop (acquire_async) —
+    async waiters do not hold a threadpool thread while queued.
+    """
+
+    def __init__(self, name: str, max_concurrency: int = 8, queue_timeout: float = 10.0,
+                 max_queue: int = 100, breaker: CircuitBreaker = None):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self.breaker = breaker or CircuitBreaker()
+        self.in_flight = 0
+        self.rejected = 0
+        self.circuit_rejected = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    def _try_enter(self, waiter: _Waiter):
+        """Take a slot or enqueue `waiter`. Returns True if a slot was taken immediately."""
+        if not self.breaker.allow():
+            with self._lock:
+                self.circuit_rejected += 1
+            raise DatabaseUnavailable(f"Database '{self.name}' is temporarily unavailable (circuit open).")
+        with self._lock:
+            if self.in_flight < self.max_concurrency and not self._waiters:
+                self.in_flight += 1
+                return True
+            if len(self._waiters) >= self.max_queue:
+                self.rejected += 1
+                raise DatabaseUnavailable(f"Database '{self.name}' is overloaded (queue full).")
+            self._waiters.append(waiter)
+            return False
+
+    def _give_up(self, waiter: _Waiter) -> bool:
+        """Called when a waiter times out. Returns True if it was granted a slot in the meantime."""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiters.remove(waiter)
+            self.rejected += 1
+            return False
+
+    def _timeout_error(self):
+        return DatabaseUnavailable(
+            f"Database '{self.name}' is busy (waited {self.queue_timeout:.0f}s for a free connection slot)."
+        )
+
+    def acquire(self):
+        """Blocking acquire for worker threads."""
+        waiter = _Waiter(event=threading.Event())
+        if self._try_enter(waiter):
+            return
+        if not waiter.event.wait(self.queue_timeout) and not self._give_up(waiter):
+            raise self._timeout_error()
+
+    async def acquire_async(self):
+        """Event-loop acquire; waits without occupying a thread."""
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(loop=loop, future=loop.create_future())
+        if self._try_enter(waiter):
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not self._give_up(waiter):
+                raise self._timeout_error()
+        except asyncio.CancelledError:
+            if self._give_up(waiter):
+                self.release()
+            raise
+
+    def release(self):
+        """Free a slot, handing it straight to the oldest waiter if there is one."""
+        with self._lock:
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                waiter.wake()
+                return
+            self.in_flight -= 1
+
+    def call(self, fn, *args, **kwargs):
+        """Run blocking DB work and feed its outcome/latency to the circuit breaker."""
+        return call_all([self], fn, *args, **kwargs)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "max_concurrency": self.max_concurrency,
+                "queue_depth": len(self._waiters),
+                "rejected": self.rejected,
+                "circuit_state": self.breaker.state,
+                "circuit_rejected": self.circuit_rejected,
+                "recent_bad_rate": round(self.breaker.bad_rate(), 3),
+            }
+
+
+def call_all(bulkheads, fn, *args, **kwargs):
+    """Bulkhead.call for work that touches several databases: the outcome counts against each one."""
+    started = time.monotonic()
+    try:
+        result = fn(*args, **kwargs)
+    except Exception as e:
+        # errors in the generated SQL still mean the database answered
+        for bulkhead in bulkheads:
+            bulkhead.breaker.record(not is_health_failure(e), time.monotonic() - started)
+        raise
+    for bulkhead in bulkheads:
+        bulkhead.breaker.record(True, time.monotonic() - started)
+    return result
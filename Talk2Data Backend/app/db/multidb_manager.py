@@ -1,12 +1,17 @@
 import json, os
+from contextlib import asynccontextmanager
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from app.db.bulkhead import Bulkhead, CircuitBreaker
 from app.utils.config import settings
 from typing import Dict
 
 # current sessionmakers
 SESSIONS = {}
 
+# per-database bulkheads; kept across refresh_databases() so counters and circuit state survive
+BULKHEADS: Dict[str, Bulkhead] = {}
+
 def build_sessions_from_dict(db_urls: Dict[str, str]):
     sessions = {}
     for name, url in db_urls.items():
@@ -35,12 +40,79 @@ def refresh_databases():
         print(f"[⚠️] refresh_databases failed: {ex}")
     return DATABASES
 
+def get_bulkhead(db_name: str) -> Bulkhead:
+    """Return (creating on first use) the concurrency bulkhead for a database."""
+    if db_name not in BULKHEADS:
+        limits = settings.database_limits(db_name)
+        BULKHEADS[db_name] = Bulkhead(
+            db_name,
+            max_concurrency=int(limits["max_concurrency"]),
+            queue_timeout=float(limits["queue_timeout"]),
+            max_queue=int(limits["max_queue"]),
+            breaker=CircuitBreaker(
+                failure_rate_threshold=float(limits["failure_rate_threshold"]),
+                slow_call_seconds=float(limits["slow_call_seconds"]),
+                open_seconds=float(limits["open_seconds"]),
+            ),
+        )
+    return BULKHEADS[db_name]
+
+def bulkhead_stats():
+    """Queue depth, in-flight, rejection counts and circuit state per database."""
+    return {name: bulkhead.stats() for name, bulkhead in BULKHEADS.items()}
+
 def get_db_session(db_name: str):
-    """Session generator (yield) for a specified database."""
+    """Session generator (yield) for a specified database. Blocks (up to the queue timeout) for a bulkhead slot."""
+    if db_name not in DATABASES:
+        raise ValueError(f"Database '{db_name}' not configured.")
+    bulkhead = get_bulkhead(db_name)
+    bulkhead.acquire()
+    try:
+        db = DATABASES[db_name]()
+        try:
+            yield db
+        finally:
+            db.close()
+    finally:
+        bulkhead.release()
+
+@asynccontextmanager
+async def db_session(db_name: str):
+    """Async counterpart of get_db_session; queues for the bulkhead slot without holding a thread."""
     if db_name not in DATABASES:
         raise ValueError(f"Database '{db_name}' not configured.")
-    db = DATABASES[db_name]()
+    bulkhead = get_bulkhead(db_name)
+    await bulkhead.acquire_async()
     try:
-        yield db
+        db = DATABASES[db_name]()
+        try:
+            yield db
+        finally:
+            db.close()
+    finally:
+        bulkhead.release()
+
+@asynccontextmanager
+async def cross_db_session(db_names):
+    """
+    Session on the first of `db_names` holding a bulkhead slot on every one of them, for a
+    query that spans databases on one instance. Slots are taken in sorted order so concurrent
+    cross-database queries can't deadlock; an open circuit on any database fails fast.
+    """
+    for db_name in db_names:
+        if db_name not in DATABASES:
+            raise ValueError(f"Database '{db_name}' not configured.")
+    held = []
+    try:
+        for db_name in sorted(set(db_names)):
+            bulkhead = get_bulkhead(db_name)
+            await bulkhead.acquire_async()
+            held.append(bulkhead)
+        db = DATABASES[db_names[0]]()
+        try:
+            yield db
+        finally:
+            db.close()
     finally:
-        db.close()
+        for bulkhead in reversed(held):
+            bulkhead.release()
@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import Dict, Optional
+from typing import Any, Dict, Optional, Union
 import json
 import os
 
@@ -9,10 +9,61 @@ class Settings(BaseSettings):
     food_db_url: Optional[str] = None
 
     # Preferred: JSON mapping for multiple DBs
-    database_urls: Dict[str, str] = {}  # pydantic will parse JSON string automatically if env var is JSON
+    # Each value is a URL, or an object with "url" plus per-database bulkhead overrides, e.g.
+    # {"fooddb": "mssql+pyodbc://...", "ordersdb": {"url": "mssql+pyodbc://...", "max_concurrency": 4, "queue_timeout": 5}}
+    database_urls: Dict[str, Union[str, Dict[str, Any]]] = {}  # pydantic will parse JSON string automatically if env var is JSON
+
+    # Per-database bulkhead + circuit breaker defaults (overridable per database_urls entry)
+    db_max_concurrency: int = 8       # concurrent sessions per database
+    db_queue_timeout: float = 10.0    # seconds to wait for a free slot before failing
+    db_max_queue: int = 100           # waiting requests per database before rejecting outright
+    db_failure_rate_threshold: float = 0.5  # open the circuit when this share of recent calls failed or was slow
+    db_slow_call_seconds: float = 10.0
+    db_circuit_open_seconds: float = 30.0
+
+    # Large-result export jobs (/multi-db-query/export)
+    export_dir: str = "exports"
+    export_max_concurrent_jobs: int = 2     # export threads per worker process
+    export_max_queued_jobs: int = 8         # waiting jobs per worker before new exports are rejected
+    export_max_disk_bytes: int = 5 * 1024 ** 3
+    export_batch_rows: int = 50_000         # rows fetched and written per batch (bounds memory)
+    export_ttl_seconds: int = 24 * 3600     # finished exports are deleted after this
+
+    # Workload capture: append one JSON line per /multi-db-query call to this file (disabled when unset)
+    capture_path: Optional[str] = None
+
+    # Semantic index sharing across uvicorn workers
+    embedding_model: str = "all-MiniLM-L6-v2"
+    index_snapshot_dir: Optional[str] = None  # one worker builds, all map the snapshot read-only
+    embedding_service_address: Optional[str] = None  # "host:port" of `python -m app.utils.embedding_service`
+    embedding_service_authkey: Optional[str] = None  # required: the service unpickles what authenticated clients send
+    embedding_service_allow_remote: bool = False      # allow binding the service to a non-loopback address
+
+    # Database selection: fused = (1 - w) * embedding cosine + w * BM25 over table/column names
+    selector_lexical_weight: float = 0.4
+    selector_threshold: float = 0.45        # minimum fused score to query a database
+    selector_relative_cutoff: float = 0.8   # ...and at least this share of the best database's score
 
     groq_api_key: str
 
+    # Batch endpoint (/multi-db-query/batch)
+    batch_max_questions: int = 500
+    batch_max_concurrency: int = 4  # concurrent SQL generation + execution tasks per batch
+
+    # LLM scheduler: per-model limits, e.g. {"llama-3.3-70b-versatile": {"rpm": 30, "tpm": 12000, "max_concurrency": 4}}
+    # Models without an entry get max_concurrency 4 and no rpm/tpm buckets; set your account's limits here.
+    llm_rate_limits: Dict[str, Dict[str, int]] = {}
+    llm_max_retries: int = 4
+    llm_backoff_base: float = 0.5  # seconds, doubled per retry (with jitter)
+    llm_backoff_max: float = 20.0
+
+    # Prompt assembly: per-model prompt budgets (tokens), e.g. {"llama-3.3-70b-versatile": 6000}
+    prompt_token_budgets: Dict[str, int] = {}
+    tokenizer_cache_dir: str = "tokenizer_data"  # holds the cl100k_base BPE file (python -m app.utils.prompt_builder)
+    require_tokenizer: bool = False  # fail instead of estimating when the tokenizer can't be loaded
+    history_token_budget: int = 1500  # most session history sent with one prompt
+    history_max_messages: int = 40    # messages kept per session (older ones are only condensed)
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
@@ -20,7 +71,10 @@ class Settings(BaseSettings):
     # helper to unify sources
     def all_databases(self) -> Dict[str, str]:
         # priority: explicit database_urls if provided, else fallback to explicit urls
-        urls = dict(self.database_urls or {})
+        urls = {
+            name: entry["url"] if isinstance(entry, dict) else entry
+            for name, entry in (self.database_urls or {}).items()
+        }
         if not urls:
             if self.database_url:
                 urls["talk2data"] = self.database_url
@@ -28,4 +82,19 @@ class Settings(BaseSettings):
                 urls["fooddb"] = self.food_db_url
         return urls
 
+    def database_limits(self, db_name: str) -> Dict[str, Any]:
+        """Bulkhead/circuit breaker settings for one database: global defaults + per-entry overrides."""
+        limits = {
+            "max_concurrency": self.db_max_concurrency,
+            "queue_timeout": self.db_queue_timeout,
+            "max_queue": self.db_max_queue,
+            "failure_rate_threshold": self.db_failure_rate_threshold,
+            "slow_call_seconds": self.db_slow_call_seconds,
+            "open_seconds": self.db_circuit_open_seconds,
+        }
+        entry = (self.database_urls or {}).get(db_name)
+        if isinstance(entry, dict):
+            limits.update({k: v for k, v in entry.items() if k in limits})
+        return limits
+
 settings = Settings()
@@ -0,0 +1,111 @@
+"""
+Shared embedding process.
+
+Loads the SentenceTransformer model once and serves embedding requests over a local
+socket, so uvicorn workers don't each hold their own copy of the model.
+
+Run it next to the API:
+    python -m app.utils.embedding_service
+and set EMBEDDING_SERVICE_ADDRESS=127.0.0.1:8765 for the workers.
+
+multiprocessing.connection pickles messages, so an authenticated peer can run code in the
+other process. Both sides therefore require an explicit EMBEDDING_SERVICE_AUTHKEY (there is
+no default), and the service only binds to loopback unless EMBEDDING_SERVICE_ALLOW_REMOTE=true.
+"""
+import ipaddress
+import threading
+from multiprocessing.connection import Client, Listener
+from typing import List
+import numpy as np
+from app.utils.config import settings
+
+_local = threading.local()
+_MODEL_LOCK = threading.Lock()  # one encode at a time; batching happens inside the model
+
+
+def _address():
+    host, _, port = settings.embedding_service_address.rpartition(":")
+    return (host or "127.0.0.1", int(port))
+
+
+def _authkey() -> bytes:
+    if not settings.embedding_service_authkey:
+        raise RuntimeError("EMBEDDING_SERVICE_AUTHKEY must be set to use the shared embedding service.")
+    return settings.embedding_service_authkey.encode()
+
+
+def _is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+# -------------------------------------------------------------------
+# CLIENT (used by semantic_selector in every worker)
+# -------------------------------------------------------------------
+def embed_remote(texts: List[str]) -> np.ndarray:
+    """Embed texts in the shared embedding process. One persistent connection per thread."""
+    for attempt in range(2):
+        conn = getattr(_local, "conn", None)
+        try:
+            if conn is None:
+                conn = _local.conn = Client(_address(), authkey=_authkey())
+            conn.send(list(texts))
+            result = conn.recv()
+        except (EOFError, OSError):
+            _local.conn = None  # service restarted: reconnect once
+            if attempt:
+                raise
+            continue
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+# -------------------------------------------------------------------
+# SERVER
+# -------------------------------------------------------------------
+def _handle(conn, model):
+    with conn:
+        while True:
+            try:
+                texts = conn.recv()
+            except EOFError:
+                return
+            try:
+                with _MODEL_LOCK:
+                    embeddings = model.encode(texts, normalize_embeddings=True).astype(np.float32)
+                conn.send(embeddings)
+            except Exception as ex:
+                conn.send(ex)
+
+
+def serve():
+    from sentence_transformers import SentenceTransformer
+
+    address, authkey = _address(), _authkey()
+    if not _is_loopback(address[0]) and not settings.embedding_service_allow_remote:
+        raise RuntimeError(
+            f"Refusing to bind the embedding service to non-loopback address {address[0]}; "
+            "set EMBEDDING_SERVICE_ALLOW_REMOTE=true if this is intended."
+        )
+
+    model = SentenceTransformer(settings.embedding_model)
+    with Listener(address, authkey=authkey) as listener:
+        print(f"[🧬] Embedding service ({settings.embedding_model}) listening on {settings.embedding_service_address}")
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as ex:  # failed handshake (wrong authkey) etc.
+                print(f"[⚠️] Embedding service rejected a connection: {ex}")
+                continue
+            threading.Thread(target=_handle, args=(conn, model), daemon=True).start()
+
+
+if __name__ == "__main__":
+    if not settings.embedding_service_address:
+        settings.embedding_service_address = "127.0.0.1:8765"
+    serve()
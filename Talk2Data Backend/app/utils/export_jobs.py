@@ -0,0 +1,319 @@
+import csv
+import gzip
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from typing import List, Optional
+from sqlalchemy import text
+from app.db.multidb_manager import get_bulkhead, get_db_session
+from app.utils.config import settings
+
+# -------------------------------------------------------------------
+# EXPORT JOBS
+#   <export_dir>/<job_id>.json              -> job status (any worker can serve polls/downloads)
+#   <export_dir>/<job_id>.parquet|.csv.gz   -> finished file (written as .part, renamed when done)
+# Rows are streamed from a server-side cursor in export_batch_rows batches, so memory stays
+# bounded by one batch regardless of result size.
+# -------------------------------------------------------------------
+FORMATS = {"parquet": ".parquet", "csv": ".csv.gz"}
+
+_EXECUTOR = None
+_EXECUTOR_LOCK = threading.Lock()
+_ACTIVE = set()  # job ids queued or running in this process
+
+
+class ExportRejected(Exception):
+    """Raised when an export can't be started (unsupported format, job or disk limits)."""
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _EXECUTOR
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            _EXECUTOR = ThreadPoolExecutor(max_workers=settings.export_max_concurrent_jobs, thread_name_prefix="export")
+    return _EXECUTOR
+
+
+def _status_path(job_id: str) -> str:
+    return os.path.join(settings.export_dir, f"{job_id}.json")
+
+
+def _save_status(job: dict):
+    tmp = _status_path(job["job_id"]) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(job, f)
+    os.replace(tmp, _status_path(job["job_id"]))
+
+
+def get_job(job_id: str) -> Optional[dict]:
+    """Current status of an export job, or None for unknown ids."""
+    if not job_id.replace("-", "").isalnum():  # ids are uuid4 hex; never let them build a path elsewhere
+        return None
+    try:
+        with open(_status_path(job_id), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def public_status(job: dict) -> dict:
+    """Job status as returned by the API (without the server-side file path)."""
+    return {k: v for k, v in job.items() if k != "path"}
+
+
+def disk_usage() -> int:
+    """Bytes currently used by the export directory."""
+    if not os.path.isdir(settings.export_dir):
+        return 0
+    return sum(entry.stat().st_size for entry in os.scandir(settings.export_dir) if entry.is_file())
+
+
+def cleanup_expired():
+    """Delete exports (and their status files) older than export_ttl_seconds."""
+    if not os.path.isdir(settings.export_dir):
+        return
+    cutoff = time.time() - settings.export_ttl_seconds
+    for entry in os.scandir(settings.export_dir):
+        if entry.is_file() and entry.stat().st_mtime < cutoff:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+# -------------------------------------------------------------------
+# WRITERS
+# -------------------------------------------------------------------
+class _CsvWriter:
+    def __init__(self, path: str, columns: List[str]):
+        self.file = gzip.open(path, "wt", encoding="utf-8", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+def _arrow_type(type_code, precision, scale):
+    """Arrow type for a DB-API cursor type code (pyodbc reports Python types), or None if unknown."""
+    import datetime
+    import pyarrow as pa
+
+    if type_code is Decimal and precision:
+        return pa.decimal128(min(int(precision), 38), int(scale or 0))
+    return {
+        bool: pa.bool_(), int: pa.int64(), float: pa.float64(), str: pa.string(),
+        bytes: pa.binary(), bytearray: pa.binary(), datetime.datetime: pa.timestamp("us"),
+        datetime.date: pa.date32(), datetime.time: pa.time64("us"),
+    }.get(type_code)
+
+
+class _ParquetWriter:
+    """
+    One row group per batch. Column types come from the cursor description where the driver
+    reports them, otherwise from the first batch (all-NULL columns become strings). A later
+    batch that doesn't fit a column's type widens it (integers -> float64, anything else ->
+    string) and the row groups already written are rewritten, instead of failing the export.
+    """
+
+    def __init__(self, path: str, columns: List[str], description=None):
+        import pyarrow  # noqa: F401 - checked at submit time, imported lazily like other optional deps
+        self.path, self.columns = path, columns
+        self.hints = [_arrow_type(d[1], d[4], d[5]) for d in description] if description else [None] * len(columns)
+        self.schema = None
+        self.writer = None
+
+    def _schema(self, data):
+        import pyarrow as pa
+
+        fields = []
+        for col, hint, values in zip(self.columns, self.hints, data):
+            kind = hint or pa.array(values).type
+            fields.append(pa.field(col, pa.string() if pa.types.is_null(kind) else kind))
+        return pa.schema(fields)
+
+    @staticmethod
+    def _array(values, kind):
+        import pyarrow as pa
+
+        if pa.types.is_string(kind):
+            try:
+                return pa.array(values, type=kind)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                return pa.array([None if v is None else str(v) for v in values], type=kind)
+        # infer then cast: pa.array(..., type=int64) silently truncates floats, a checked cast raises
+        return pa.array(values).cast(kind)
+
+    def _widen(self, i: int, values):
+        """Column i can't hold this batch: widen its type and rewrite the row groups written so far."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        field = self.schema.field(i)
+        try:
+            seen = pa.array(values).type
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            seen = pa.string()
+        numeric = [pa.types.is_integer(t) or pa.types.is_floating(t) or pa.types.is_decimal(t) for t in (field.type, seen)]
+        kind = pa.float64() if all(numeric) else pa.string()
+        print(f"[⚠️] Export column '{field.name}' changed type ({field.type} -> {seen}); storing it as {kind}.")
+
+        self.schema = self.schema.set(i, field.with_type(kind))
+        self.writer.close()
+        previous = self.path + ".widen"
+        os.replace(self.path, previous)
+        try:
+            self.writer = pq.ParquetWriter(self.path, self.schema, compression="zstd")
+            source = pq.ParquetFile(previous)
+            for group in range(source.num_row_groups):  # one batch in memory at a time
+                self.writer.write_table(source.read_row_group(group).cast(self.schema))
+        finally:
+            os.remove(previous)
+
+    def write(self, rows):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        data = [[row[i] for row in rows] for i in range(len(self.columns))]
+        if self.schema is None:
+            self.schema = self._schema(data)
+            self.writer = pq.ParquetWriter(self.path, self.schema, compression="zstd")
+        arrays = []
+        for i, values in enumerate(data):
+            try:
+                arrays.append(self._array(values, self.schema.field(i).type))
+            except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+                self._widen(i, values)
+                arrays.append(self._array(values, self.schema.field(i).type))
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        if self.writer is None:  # empty result: still produce a valid (empty) file
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            self.schema = self._schema([[] for _ in self.columns])
+            self.writer = pq.ParquetWriter(self.path, self.schema, compression="zstd")
+        self.writer.close()
+
+
+def _csv_value(value):
+    return float(value) if isinstance(value, Decimal) else value
+
+
+# -------------------------------------------------------------------
+# JOB EXECUTION
+# -------------------------------------------------------------------
+def _run(job: dict):
+    part_path = job["path"] + ".part"
+    writer = None
+    try:
+        job.update(status="running", started=time.time())
+        _save_status(job)
+
+        session_gen = get_db_session(job["database"])  # holds one bulkhead slot for the whole export
+        db = next(session_gen)
+        # the query and each batch fetch report to the circuit breaker separately, so
+        # failures mid-stream count but a long export isn't one slow call
+        bulkhead = get_bulkhead(job["database"])
+        try:
+            # stream_results -> server-side cursor; yield_per -> fetch in fixed-size batches
+            result = bulkhead.call(
+                db.execute,
+                text(job["sql"]),
+                execution_options={"stream_results": True, "yield_per": settings.export_batch_rows},
+            )
+            columns = list(result.keys())
+            if job["format"] == "parquet":
+                writer = _ParquetWriter(part_path, columns, getattr(result.cursor, "description", None))
+            else:
+                writer = _CsvWriter(part_path, columns)
+
+            batches = result.partitions(settings.export_batch_rows)
+            while True:
+                batch = bulkhead.call(next, batches, None)
+                if batch is None:
+                    break
+                rows = [tuple(row) for row in batch]
+                writer.write(rows if job["format"] == "parquet" else [tuple(_csv_value(v) for v in row) for row in rows])
+                job["rows_written"] += len(rows)
+                job["bytes_written"] = os.path.getsize(part_path)
+                _save_status(job)
+                if disk_usage() > settings.export_max_disk_bytes:
+                    raise ExportRejected("Export directory is over its disk limit; export aborted.")
+            writer.close()
+            writer = None
+        finally:
+            session_gen.close()
+
+        os.replace(part_path, job["path"])
+        job.update(status="done", bytes_written=os.path.getsize(job["path"]), finished=time.time())
+        print(f"[📤] Export {job['job_id']} done: {job['rows_written']} rows, {job['bytes_written']} bytes")
+    except Exception as ex:
+        if writer is not None:
+            try:
+                writer.close()
+            except Exception:
+                pass
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        job.update(status="failed", error=f"{type(ex).__name__}: {ex}", finished=time.time())
+        print(f"[⚠️] Export {job['job_id']} failed: {ex}")
+    finally:
+        _save_status(job)
+        _ACTIVE.discard(job["job_id"])
+
+
+def check_export(fmt: str = "parquet", jobs: int = 1) -> str:
+    """
+    Raise ExportRejected unless `jobs` exports in `fmt` could start now (format supported,
+    job and disk limits not reached). Returns the normalised format. Cheap: callers run it
+    before generating SQL, and submit_export runs it again.
+    """
+    fmt = (fmt or "parquet").lower()
+    if fmt not in FORMATS:
+        raise ExportRejected(f"Unsupported export format '{fmt}' (use one of {', '.join(FORMATS)}).")
+    if fmt == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ExportRejected("Parquet export needs pyarrow installed; use format 'csv' instead.")
+
+    os.makedirs(settings.export_dir, exist_ok=True)
+    cleanup_expired()
+    if len(_ACTIVE) + jobs > settings.export_max_concurrent_jobs + settings.export_max_queued_jobs:
+        raise ExportRejected("Too many export jobs in progress; try again later.")
+    if disk_usage() >= settings.export_max_disk_bytes:
+        raise ExportRejected("Export directory is full; try again after older exports expire.")
+    return fmt
+
+
+def submit_export(database: str, sql: str, fmt: str = "parquet") -> dict:
+    """Queue an export of `sql` on `database`. Returns the initial job status."""
+    fmt = check_export(fmt)
+
+    job_id = uuid.uuid4().hex
+    job = {
+        "job_id": job_id,
+        "database": database,
+        "sql": sql,
+        "format": fmt,
+        "status": "queued",
+        "rows_written": 0,
+        "bytes_written": 0,
+        "error": None,
+        "created": time.time(),
+        "started": None,
+        "finished": None,
+        "path": os.path.join(os.path.abspath(settings.export_dir), job_id + FORMATS[fmt]),
+    }
+    _save_status(job)
+    _ACTIVE.add(job_id)
+    _executor().submit(_run, job)
+    return job
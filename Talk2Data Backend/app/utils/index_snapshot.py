@@ -0,0 +1,92 @@
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+import numpy as np
+
+# -------------------------------------------------------------------
+# ON-DISK LAYOUT
+#   <dir>/CURRENT            -> name of the live version (swapped atomically with os.replace)
+#   <dir>/v-<version>/vectors.npy, metas.json
+#   <dir>/build.lock         -> held by the one process rebuilding the index
+# -------------------------------------------------------------------
+_CURRENT = "CURRENT"
+_LOCK = "build.lock"
+_KEEP_VERSIONS = 3  # older versions may still be mapped by slow workers
+
+
+def current_version(snapshot_dir: str) -> Optional[str]:
+    try:
+        with open(os.path.join(snapshot_dir, _CURRENT), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def version_age(version: str) -> float:
+    """Seconds since a version was written (versions start with a millisecond timestamp)."""
+    return time.time() - int(version.split("-")[0]) / 1000
+
+
+def write_snapshot(snapshot_dir: str, vectors: np.ndarray, metas: List[dict]) -> str:
+    """Write a new index version and make it current. Returns the version name."""
+    os.makedirs(snapshot_dir, exist_ok=True)
+    version = f"{int(time.time() * 1000)}-{os.getpid()}"
+    tmp_dir = os.path.join(snapshot_dir, f"tmp-{version}")
+    os.makedirs(tmp_dir)
+    np.save(os.path.join(tmp_dir, "vectors.npy"), np.ascontiguousarray(vectors, dtype=np.float32))
+    with open(os.path.join(tmp_dir, "metas.json"), "w", encoding="utf-8") as f:
+        json.dump(metas, f)
+    os.replace(tmp_dir, os.path.join(snapshot_dir, f"v-{version}"))
+
+    pointer_tmp = os.path.join(snapshot_dir, f"{_CURRENT}.{version}.tmp")
+    with open(pointer_tmp, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(pointer_tmp, os.path.join(snapshot_dir, _CURRENT))
+
+    _prune_old_versions(snapshot_dir)
+    return version
+
+
+def load_snapshot(snapshot_dir: str, version: str) -> Tuple[np.ndarray, List[dict]]:
+    """Map a version read-only; the page cache is shared by every process that maps it."""
+    version_dir = os.path.join(snapshot_dir, f"v-{version}")
+    vectors = np.load(os.path.join(version_dir, "vectors.npy"), mmap_mode="r")
+    with open(os.path.join(version_dir, "metas.json"), encoding="utf-8") as f:
+        metas = json.load(f)
+    return vectors, metas
+
+
+def _prune_old_versions(snapshot_dir: str):
+    versions = sorted(d for d in os.listdir(snapshot_dir) if d.startswith("v-"))
+    for old in versions[:-_KEEP_VERSIONS]:
+        # on Windows a version still mapped by a worker cannot be removed yet; try again next build
+        shutil.rmtree(os.path.join(snapshot_dir, old), ignore_errors=True)
+
+
+@contextmanager
+def build_lock(snapshot_dir: str, stale_after: float = 600):
+    """
+    Cross-process, non-blocking build lock (O_EXCL lock file, works on Windows and POSIX).
+    Yields True if this process should build; a lock older than `stale_after` seconds is broken.
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    path = os.path.join(snapshot_dir, _LOCK)
+    try:
+        if os.path.exists(path) and time.time() - os.path.getmtime(path) > stale_after:
+            os.remove(path)
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except (FileExistsError, PermissionError):
+        yield False
+        return
+    try:
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        yield True
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,84 @@
+import math
+import re
+from collections import Counter
+from typing import Dict, List
+
+# -------------------------------------------------------------------
+# TOKENIZATION
+# -------------------------------------------------------------------
+# Schema identifiers are split into words (DishName -> dish name, order_items -> order items,
+# CustomerID -> customer id) so they match how people phrase questions.
+_WORD = re.compile(r"[A-Za-z0-9]+")
+_CAMEL = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+_STOPWORDS = {
+    "a", "an", "the", "of", "in", "on", "for", "to", "by", "with", "and", "or", "from", "at", "as",
+    "is", "are", "was", "were", "be", "me", "my", "our", "we", "i", "you", "it", "its", "this", "that",
+    "show", "list", "give", "get", "find", "display", "what", "which", "who", "whose", "how", "many",
+    "much", "all", "each", "per", "every", "any", "some", "there", "do", "does", "did", "have", "has",
+    "please", "can", "could", "would", "tell", "about", "than", "more", "less", "top",
+}
+
+
+def _stem(word: str) -> str:
+    """Plural folding only (cities -> city, dishes -> dish, sizes -> size, orders -> order)."""
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and word.endswith(("sses", "xes", "ches", "shes", "zzes")):
+        return word[:-2]  # classes, boxes, dishes, branches: the singular ends in ss/x/ch/sh/zz
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def split_identifier(name: str) -> List[str]:
+    words = []
+    for part in _WORD.findall(name):
+        words.extend(w.lower() for w in _CAMEL.findall(part))
+    return words
+
+
+def tokenize(text: str) -> List[str]:
+    return [_stem(w) for w in split_identifier(text) if w not in _STOPWORDS]
+
+
+# -------------------------------------------------------------------
+# BM25 INVERTED INDEX
+# -------------------------------------------------------------------
+class BM25Index:
+    """
+    Okapi BM25 over a small, fixed set of documents (one per table).
+    Postings are precomputed at build time; scoring touches only the query terms.
+    """
+
+    def __init__(self, documents: List[List[str]], k1: float = 1.2, b: float = 0.75):
+        self.k1, self.b = k1, b
+        self.size = len(documents)
+        self.doc_len = [len(doc) for doc in documents]
+        self.avg_len = (sum(self.doc_len) / self.size) if self.size else 0.0
+        self.postings: Dict[str, List[tuple]] = {}
+        for i, doc in enumerate(documents):
+            for term, tf in Counter(doc).items():
+                self.postings.setdefault(term, []).append((i, tf))
+        self.idf = {
+            term: math.log(1 + (self.size - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def scores(self, query_terms: List[str]) -> List[float]:
+        """
+        Per-document BM25 score normalised by the query's matchable weight: 1.0 roughly means
+        every known query term appears once in a document of average length. Unknown terms
+        (words that name no table or column) are ignored rather than counted as misses.
+        """
+        out = [0.0] * self.size
+        terms = [t for t in set(query_terms) if t in self.postings]
+        norm = sum(self.idf[t] for t in terms)
+        if not norm:
+            return out
+        for term in terms:
+            idf = self.idf[term]
+            for i, tf in self.postings[term]:
+                length_norm = 1 - self.b + self.b * self.doc_len[i] / (self.avg_len or 1)
+                out[i] += idf * tf * (self.k1 + 1) / (tf + self.k1 * length_norm)
+        return [min(1.0, s / norm) for s in out]
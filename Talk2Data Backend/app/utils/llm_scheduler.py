@@ -0,0 +1,251 @@
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from collections import deque
+from typing import Dict, Optional
+from fastapi.concurrency import run_in_threadpool
+from openai import APIConnectionError, APIStatusError
+from app.utils.prompt_builder import count_message_tokens
+
+# -------------------------------------------------------------------
+# PRIORITIES (lower value is served first)
+# -------------------------------------------------------------------
+PRIORITY_INTERACTIVE = 0  # SQL generation for /multi-db-query
+PRIORITY_SUMMARY = 1      # generate_human_response
+PRIORITY_BATCH = 2        # /multi-db-query/batch
+
+# Used for models without an entry in settings.llm_rate_limits. Rate buckets are opt-in:
+# rpm/tpm of None mean no limit, so only the concurrency cap (and AIMD) applies until the
+# account's real limits are configured.
+DEFAULT_LIMITS = {"rpm": None, "tpm": None, "max_concurrency": 4}
+
+_ERROR_WINDOW = 20           # recent outcomes kept per model for the error rate
+_ERROR_RATE_THRESHOLD = 0.2  # halve concurrency when the recent error rate reaches this
+_MIN_SAMPLES = 5             # outcomes needed (since the last halving) before the rate counts
+
+
+def estimate_tokens(messages, max_tokens: Optional[int] = None) -> int:
+    """Prompt + completion token estimate used for the TPM bucket (corrected with actual usage afterwards)."""
+    return count_message_tokens(messages) + (max_tokens or 512)
+
+
+def _is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, APIConnectionError):  # includes APITimeoutError
+        return True
+    return isinstance(exc, APIStatusError) and (exc.status_code == 429 or exc.status_code >= 500)
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    """Seconds the provider asked us to wait, from retry-after-ms / retry-after headers."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        return None  # HTTP-date form; fall back to our own backoff
+    return None
+
+
+# -------------------------------------------------------------------
+# TOKEN BUCKET
+# -------------------------------------------------------------------
+class TokenBucket:
+    """Refills `per_minute` units evenly over a minute, holding at most one minute's worth."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units are available (0 if available now)."""
+        self._refill()
+        amount = min(amount, self.capacity)  # oversized requests only need a full bucket
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        """Take `amount` units; negative amounts refund. May go below zero after a correction."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+# -------------------------------------------------------------------
+# PER-MODEL LANE
+# -------------------------------------------------------------------
+class _ModelLane:
+    def __init__(self, model: str, limits: dict):
+        self.model = model
+        self.requests = TokenBucket(limits["rpm"]) if limits.get("rpm") else None
+        self.tokens = TokenBucket(limits["tpm"]) if limits.get("tpm") else None
+        self.max_concurrency = max(1, int(limits["max_concurrency"]))
+        self.limit = self.max_concurrency  # adaptive, between 1 and max_concurrency
+        self.in_flight = 0
+        self.waiters = []  # heap of (priority, seq, estimated_tokens, future)
+        self.outcomes = deque(maxlen=_ERROR_WINDOW)
+        self.success_streak = 0
+        self.paused_until = 0.0
+        self.timer = None
+
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+
+# -------------------------------------------------------------------
+# SCHEDULER
+# -------------------------------------------------------------------
+class LLMScheduler:
+    """
+    Central gate for chat completions.
+    Requests wait in a per-model priority queue until the model's request and token
+    buckets (when configured) allow them and a concurrency slot is free. Retryable failures (429, 5xx,
+    timeouts) back off with jitter, honouring retry-after, and feed an AIMD concurrency limit.
+    """
+
+    def __init__(self, client, limits: Optional[Dict[str, dict]] = None,
+                 max_retries: int = 4, backoff_base: float = 0.5, backoff_max: float = 20.0):
+        self.client = client
+        self.limits = limits or {}
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lanes: Dict[str, _ModelLane] = {}
+        self._seq = itertools.count()
+
+    def _lane(self, model: str) -> _ModelLane:
+        if model not in self._lanes:
+            self._lanes[model] = _ModelLane(model, {**DEFAULT_LIMITS, **self.limits.get(model, {})})
+        return self._lanes[model]
+
+    async def chat(self, model: str, messages, priority: int = PRIORITY_INTERACTIVE, **kwargs):
+        """
+        Run client.chat.completions.create through the scheduler.
+        Returns (completion, stats) where stats holds queue_wait_ms and attempts.
+        """
+        lane = self._lane(model)
+        estimate = estimate_tokens(messages, kwargs.get("max_tokens"))
+        stats = {"model": model, "priority": priority, "queue_wait_ms": 0.0, "attempts": 0}
+
+        for attempt in range(self.max_retries + 1):
+            stats["queue_wait_ms"] += await self._acquire(lane, priority, estimate) * 1000
+            stats["attempts"] = attempt + 1
+            try:
+                completion = await run_in_threadpool(lambda: self.client.chat.completions.create(
+                    model=model, messages=messages, **kwargs
+                ))
+            except Exception as e:
+                retryable = _is_retryable(e)
+                self._release(lane, ok=False if retryable else None)
+                if not retryable or attempt == self.max_retries:
+                    raise
+                retry_after = _retry_after(e)
+                if retry_after:
+                    lane.paused_until = max(lane.paused_until, time.monotonic() + retry_after)
+                delay = self._backoff(attempt, retry_after)
+                print(f"[⏳] {model} {type(e).__name__}; retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # cancelled while the call was in flight: free the slot, the outcome says nothing
+                self._release(lane, ok=None)
+                raise
+
+            # correct the token bucket with what the provider actually counted
+            if completion.usage and lane.tokens:
+                lane.tokens.consume(completion.usage.total_tokens - estimate)
+            self._release(lane, ok=True)
+            stats["queue_wait_ms"] = round(stats["queue_wait_ms"], 1)
+            return completion, stats
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        """Full-jitter exponential backoff, never shorter than the provider's retry-after."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        return max(delay, retry_after or 0.0)
+
+    async def _acquire(self, lane: _ModelLane, priority: int, estimate: int) -> float:
+        """Wait for a slot; returns seconds spent queued."""
+        fut = asyncio.get_running_loop().create_future()
+        enqueued = time.monotonic()
+        heapq.heappush(lane.waiters, (priority, next(self._seq), estimate, fut))
+        self._pump(lane)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self._release(lane, ok=None)  # slot was granted just as we were cancelled
+            raise
+        return time.monotonic() - enqueued
+
+    def _pump(self, lane: _ModelLane):
+        """Grant slots to queued requests in priority order while limits allow."""
+        if lane.timer:
+            lane.timer.cancel()
+            lane.timer = None
+        while lane.waiters:
+            priority, seq, estimate, fut = lane.waiters[0]
+            if fut.done():  # cancelled while waiting
+                heapq.heappop(lane.waiters)
+                continue
+            if lane.in_flight >= lane.limit:
+                return  # _release pumps again
+            wait = max(
+                lane.paused_until - time.monotonic(),
+                lane.requests.wait_time(1) if lane.requests else 0.0,
+                lane.tokens.wait_time(estimate) if lane.tokens else 0.0,
+            )
+            if wait > 0:
+                lane.timer = asyncio.get_running_loop().call_later(wait, self._pump, lane)
+                return
+            heapq.heappop(lane.waiters)
+            if lane.requests:
+                lane.requests.consume(1)
+            if lane.tokens:
+                lane.tokens.consume(estimate)
+            lane.in_flight += 1
+            fut.set_result(None)
+
+    def _release(self, lane: _ModelLane, ok: Optional[bool]):
+        """Free a slot. ok=None means the outcome says nothing about provider health."""
+        lane.in_flight -= 1
+        if ok is not None:
+            lane.outcomes.append(ok)
+            if not ok and len(lane.outcomes) >= _MIN_SAMPLES and lane.error_rate() >= _ERROR_RATE_THRESHOLD:
+                if lane.limit > 1:
+                    lane.limit = max(1, lane.limit // 2)
+                    print(f"[📉] {lane.model} concurrency reduced to {lane.limit}")
+                lane.outcomes.clear()
+                lane.success_streak = 0
+            elif ok:
+                lane.success_streak += 1
+                if lane.success_streak >= lane.limit and lane.limit < lane.max_concurrency:
+                    lane.limit += 1
+                    lane.success_streak = 0
+        self._pump(lane)
+
+    def stats(self) -> dict:
+        """Current per-model queue and concurrency state."""
+        return {
+            model: {
+                "queued": sum(1 for w in lane.waiters if not w[3].done()),
+                "in_flight": lane.in_flight,
+                "concurrency_limit": lane.limit,
+                "error_rate": round(lane.error_rate(), 3),
+            }
+            for model, lane in self._lanes.items()
+        }
@@ -0,0 +1,215 @@
+import os
+import threading
+from typing import Dict, List, Tuple
+from app.utils.config import settings
+
+# -------------------------------------------------------------------
+# TOKEN COUNTING
+# -------------------------------------------------------------------
+# tiktoken is optional: cl100k_base is within a few percent of the Llama 3 tokenizer on
+# English + SQL text. Its BPE file is read from settings.tokenizer_cache_dir (seed it at build
+# time with `python -m app.utils.prompt_builder`; tiktoken checks the file's hash), so workers
+# never download it at runtime. Without it counting falls back to a deliberately high
+# ~3 chars/token estimate, so budgets still hold; REQUIRE_TOKENIZER=true makes that an error.
+_ENCODER = None
+_ENCODER_LOADED = False
+_ENCODER_LOCK = threading.Lock()
+
+_MESSAGE_OVERHEAD = 4  # role + separators per chat message
+
+# Prompt budgets (tokens) for models without an entry in settings.prompt_token_budgets
+DEFAULT_BUDGETS = {"llama-3.3-70b-versatile": 6000, "llama3-8b-8192": 3000}
+DEFAULT_BUDGET = 4000
+
+_COMPACT_TOKENS = 24  # per side of a compacted turn
+
+
+def _get_encoder():
+    global _ENCODER, _ENCODER_LOADED
+    if not _ENCODER_LOADED:
+        with _ENCODER_LOCK:
+            if not _ENCODER_LOADED:
+                try:
+                    _ENCODER = _load_encoder()
+                except Exception as ex:  # not installed, or the encoding file isn't in the cache dir
+                    if settings.require_tokenizer:
+                        raise RuntimeError(f"cl100k_base tokenizer unavailable: {ex}") from ex
+                    print(f"[❗] tiktoken unavailable ({type(ex).__name__}: {ex}); "
+                          f"token counts are conservative estimates (~3 chars each). "
+                          f"Seed {settings.tokenizer_cache_dir} with `python -m app.utils.prompt_builder`.")
+                _ENCODER_LOADED = True
+    return _ENCODER
+
+
+_CL100K_URL = "https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken"
+
+
+def _load_encoder(allow_download: bool = False):
+    import hashlib
+    import tiktoken
+
+    cache_dir = os.path.abspath(settings.tokenizer_cache_dir)
+    os.environ["TIKTOKEN_CACHE_DIR"] = cache_dir
+    # tiktoken names cached files by the sha1 of their URL
+    cached = os.path.join(cache_dir, hashlib.sha1(_CL100K_URL.encode()).hexdigest())
+    if not allow_download and not os.path.exists(cached):
+        raise FileNotFoundError(f"cl100k_base is not cached in {cache_dir}")
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoder = _get_encoder()
+    if encoder is None:
+        return len(text) // 3 + 1
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages: List[dict]) -> int:
+    return sum(count_tokens(m.get("content") or "") + _MESSAGE_OVERHEAD for m in messages)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text down to at most `max_tokens` tokens (marked with an ellipsis when cut)."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoder = _get_encoder()
+    if encoder is None:
+        return text[: max(0, max_tokens * 3 - 1)] + "…"
+    return encoder.decode(encoder.encode(text, disallowed_special=())[: max(0, max_tokens - 1)]) + "…"
+
+
+def prompt_budget(model: str) -> int:
+    return settings.prompt_token_budgets.get(model) or DEFAULT_BUDGETS.get(model, DEFAULT_BUDGET)
+
+
+# -------------------------------------------------------------------
+# HISTORY COMPACTION
+# -------------------------------------------------------------------
+def _compact_lines(messages: List[dict]) -> List[str]:
+    """One short line per old turn: the question and the start of the reply."""
+    lines = []
+    for m in messages:
+        content = truncate_to_tokens(" ".join((m.get("content") or "").split()), _COMPACT_TOKENS)
+        if m["role"] == "user" or not lines:
+            lines.append(f"- {content}")
+        else:
+            lines[-1] += f" → {content}"
+    return lines
+
+
+def _summary_message(lines: List[str]) -> dict:
+    return {"role": "user", "content": "Earlier in this conversation (condensed):\n" + "\n".join(lines)}
+
+
+def fit_history(history: List[dict], budget: int) -> Tuple[List[dict], Dict[str, int]]:
+    """
+    Fit session history into `budget` tokens.
+    If it all fits it is sent verbatim. Otherwise the newest turns stay verbatim (within
+    two thirds of the budget) and older turns are condensed into one line each; the
+    oldest condensed lines are dropped only when even those don't fit.
+    """
+    budget = min(budget, settings.history_token_budget)
+    history = [{"role": m["role"], "content": m["content"]} for m in history]
+    if count_message_tokens(history) <= budget:
+        return history, {"history": count_message_tokens(history), "verbatim": len(history), "compacted": 0, "dropped": 0}
+
+    verbatim_budget = budget * 2 // 3
+    used, split = 0, len(history)
+    for i in range(len(history) - 1, -1, -1):
+        cost = count_message_tokens([history[i]])
+        if used + cost > verbatim_budget:
+            break
+        used += cost
+        split = i
+    while split < len(history) and history[split]["role"] != "user":
+        used -= count_message_tokens([history[split]])  # start the verbatim part on a question
+        split += 1
+    kept = history[split:]
+
+    lines = _compact_lines(history[:split])
+    total_lines = len(lines)
+    while lines and used + count_message_tokens([_summary_message(lines)]) > budget:
+        lines = lines[1:]
+    if lines:
+        summary = _summary_message(lines)
+        kept.insert(0, summary)
+        used += count_message_tokens([summary])
+
+    return kept, {"history": used, "verbatim": len(history) - split,
+                  "compacted": len(lines), "dropped": total_lines - len(lines)}
+
+
+# -------------------------------------------------------------------
+# PROMPT ASSEMBLY
+# -------------------------------------------------------------------
+class PromptTooLarge(Exception):
+    """Raised when a prompt can't be brought within its model's token budget."""
+
+
+SCHEMA_MARKER = "Schema:"  # line separating a prefix's instructions from its schema
+
+
+def _fit_prefix(prefix: str, max_tokens: int) -> Tuple[str, int]:
+    """
+    Drop schema lines from the end (relationships first, then tables) until the prefix fits.
+    Only lines after the SCHEMA_MARKER line are dropped; the instructions above it always stay.
+    Returns (prefix, number of lines dropped).
+    """
+    lines = prefix.split("\n")
+    costs = [count_tokens(line) + 1 for line in lines]
+    start = len(lines) - lines[::-1].index(SCHEMA_MARKER) if SCHEMA_MARKER in lines else len(lines)
+    schema = list(enumerate(lines))[start:]
+    droppable = [i for i, line in schema if line.startswith("Table: ")]
+    droppable += [i for i, line in schema if line.startswith("- ")]  # relationships are popped first
+    note = "(Schema truncated to fit the prompt budget; only the tables above are available.)"
+
+    dropped, total = set(), sum(costs) + count_tokens(note)
+    while droppable:
+        if total <= max_tokens:
+            fitted = "\n".join([line for i, line in enumerate(lines) if i not in dropped] + [note])
+            if count_tokens(fitted) <= max_tokens:  # per-line counts are only approximately additive
+                return fitted, len(dropped)
+        i = droppable.pop()
+        dropped.add(i)
+        total -= costs[i]
+    raise PromptTooLarge(f"Prompt instructions alone exceed the budget ({max_tokens} tokens).")
+
+
+def build_messages(model: str, prefix: str, question: str, history: List[dict] = None,
+                   reserve_tokens: int = 512) -> Tuple[List[dict], Dict[str, int]]:
+    """
+    Chat messages ordered for provider-side prefix caching:
+      1. system: `prefix` (instructions + schema) — identical across turns and users of a database
+      2. history (verbatim recent turns, older ones condensed) — changes every turn
+      3. user: `question`
+    The model budget is a hard limit: history gets whatever is left after the prefix, the
+    question and `reserve_tokens` for the completion; if even the prefix doesn't fit, schema
+    lines (those after a SCHEMA_MARKER line) are dropped, and PromptTooLarge is raised when
+    that isn't enough.
+    Returns (messages, token stats).
+    """
+    budget = prompt_budget(model)
+    question_cost = count_message_tokens([{"content": question}])
+    prefix_room = budget - reserve_tokens - question_cost - _MESSAGE_OVERHEAD
+    if prefix_room <= 0:
+        raise PromptTooLarge(f"Question is too long for {model} ({question_cost} tokens, budget {budget}).")
+
+    truncated = 0
+    if count_tokens(prefix) > prefix_room:
+        prefix, truncated = _fit_prefix(prefix, prefix_room)
+        print(f"[✂️] Prompt for {model} over budget ({budget}); dropped {truncated} schema lines.")
+
+    fixed = count_message_tokens([{"content": prefix}]) + question_cost
+    history_messages, stats = fit_history(history or [], max(0, budget - fixed - reserve_tokens))
+    messages = [{"role": "system", "content": prefix}, *history_messages, {"role": "user", "content": question}]
+    stats.update(prefix=count_message_tokens(messages[:1]), total=fixed + stats["history"], budget=budget,
+                 schema_lines_dropped=truncated)
+    return messages, stats
+
+
+if __name__ == "__main__":
+    # seed settings.tokenizer_cache_dir (run at image build time, where network access is available)
+    _load_encoder(allow_download=True)
+    print(f"[✅] cl100k_base cached in {os.path.abspath(settings.tokenizer_cache_dir)}")
@@ -0,0 +1,87 @@
+from typing import Dict, List, Optional
+from sqlalchemy.engine import make_url
+from app.utils.config import settings
+
+
+# -------------------------------------------------------------------
+# INSTANCE DETECTION
+# -------------------------------------------------------------------
+def _server_key(url: str) -> Optional[tuple]:
+    """Identity of the server a URL points at (None for file-based backends like SQLite)."""
+    try:
+        u = make_url(url)
+    except Exception:
+        return None
+    if u.get_backend_name() == "sqlite" or not u.host:
+        return None
+    return (u.get_backend_name(), u.host.lower(), u.port, u.username)
+
+
+def catalog_name(db_name: str) -> str:
+    """Database name on the server (from the URL), used for three-part table names."""
+    url = settings.all_databases().get(db_name)
+    try:
+        return make_url(url).database or db_name
+    except Exception:
+        return db_name
+
+
+def shares_instance(db_names: List[str]) -> bool:
+    """True when 2+ databases live on the same server, so one query can join across them."""
+    if len(db_names) < 2:
+        return False
+    urls = settings.all_databases()
+    keys = {_server_key(urls.get(name, "")) for name in db_names}
+    return len(keys) == 1 and None not in keys
+
+
+# -------------------------------------------------------------------
+# COMBINED SCHEMA PROMPT
+# -------------------------------------------------------------------
+def _prune_tables(schema_info: dict, wanted: List[str]) -> List[str]:
+    """Keep the embedding-ranked tables plus anything one foreign-key hop away from them."""
+    tables = list(schema_info.get("tables", {}).keys())
+    if not wanted:
+        return tables
+    keep = [t for t in tables if t in wanted]
+    for rel in schema_info.get("relations", []):
+        src, dst = rel["table"], rel["references"]
+        if src in keep and dst not in keep:
+            keep.append(dst)
+        elif dst in keep and src not in keep:
+            keep.append(src)
+    return keep or tables
+
+
+def build_cross_db_schema(schemas: Dict[str, dict], table_hits: Dict[str, List[str]]) -> str:
+    """
+    One schema prompt covering several databases on the same instance, with every
+    table written as a three-part name so the generated SQL can join server-side.
+    """
+    text = "You are a SQL generator for a Microsoft SQL Server instance hosting several databases.\n"
+    text += "Always reference tables by their full three-part name (database.dbo.table) exactly as listed; "
+    text += "cross-database JOINs are allowed and run on the server.\n\n"
+
+    relations = []
+    for db_name, schema_info in schemas.items():
+        catalog = catalog_name(db_name)
+        kept = _prune_tables(schema_info, table_hits.get(db_name, []))
+        text += f"Database: {catalog}\n"
+        for table in kept:
+            columns = schema_info["tables"][table]
+            text += f"Table: {catalog}.dbo.{table} (Columns: {', '.join(columns)})\n"
+        text += "\n"
+        for rel in schema_info.get("relations", []):
+            if rel["table"] in kept and rel["references"] in kept:
+                relations.append(
+                    f"{catalog}.dbo.{rel['table']}.{rel['column']} → {catalog}.dbo.{rel['references']}.{rel['ref_column']}"
+                )
+
+    if relations:
+        text += "Relationships for JOINs:\n"
+        for rel in relations:
+            text += f"- {rel}\n"
+        text += "\n"
+
+    text += "Always output `only` the SQL query text without explanation or markdown. Do NOT use columns that are not listed above."
+    return text
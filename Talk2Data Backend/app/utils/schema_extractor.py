@@ -60,4 +60,17 @@ def get_dynamic_schema_text(db):
     # The hash logic remains the same, so caching still works
     schema_hash = hashlib.sha256(json.dumps(schema_info, sort_keys=True).encode()).hexdigest()
 
-    return {"text": schema_text, "hash": schema_hash}
\ No newline at end of file
+    # Structured form for callers that build their own prompt (e.g. the cross-database planner)
+    tables = {table: [c["name"] for c in details["columns"]] for table, details in schema_info.items()}
+    structured_relations = [
+        {
+            "table": table,
+            "column": fk["column"][0],
+            "references": fk["references"],
+            "ref_column": fk["ref_column"][0],
+        }
+        for table, details in schema_info.items()
+        for fk in details["foreign_keys"]
+    ]
+
+    return {"text": schema_text, "hash": schema_hash, "tables": tables, "relations": structured_relations}
\ No newline at end of file
@@ -1,14 +1,16 @@
 import time
 import threading
 import warnings
-from typing import List
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
+from typing import Dict, List
 from app.db.multidb_manager import refresh_databases
 import numpy as np
 from sqlalchemy import exc as sa_exc
-from app.db.multidb_manager import get_db_session, DATABASES
+from app.db.multidb_manager import get_db_session, get_bulkhead, DATABASES
+from app.db.bulkhead import DatabaseUnavailable, is_health_failure
+from app.utils.config import settings
 from app.utils.schema_extractor import get_dynamic_schema_text
+from app.utils import index_snapshot
+from app.utils.lexical_index import BM25Index, tokenize
 
 # -------------------------------------------------------------------
 # SILENCE SQLALCHEMY WARNINGS
@@ -18,139 +20,307 @@ warnings.filterwarnings("ignore", category=sa_exc.SAWarning)
 # -------------------------------------------------------------------
 # GLOBAL SETTINGS
 # -------------------------------------------------------------------
-_VECTOR_INDEX = []
+# Index = one L2-normalised vector per entry (row) + matching metadata.
+# With settings.index_snapshot_dir the vectors are a read-only memory map shared by all workers.
+_INDEX_VECTORS = np.zeros((0, 0), dtype=np.float32)
+_INDEX_METAS = []
+_LEXICAL = BM25Index([])  # BM25 over table/column names, one document per table entry
+_LEXICAL_ENTRIES = []     # index entry position of each lexical document
+_INDEX_VERSION = None
 _INDEX_LOCK = threading.Lock()
 _LAST_INDEX_BUILD = 0
 _INDEX_TTL = 60 * 5  # 5 minutes cache
+_SNAPSHOT_WAIT = 120  # seconds a worker waits for another process's first build
 
 # -------------------------------------------------------------------
 # EMBEDDING MODEL
 # -------------------------------------------------------------------
-# all-MiniLM-L6-v2 is lightweight and accurate for schema-level semantics
-_model = SentenceTransformer("all-MiniLM-L6-v2")
+# all-MiniLM-L6-v2 is lightweight and accurate for schema-level semantics.
+# Loaded lazily, and never in workers that use the shared embedding service.
+_model = None
+_MODEL_LOCK = threading.Lock()
+
+def _get_model():
+    global _model
+    with _MODEL_LOCK:
+        if _model is None:
+            from sentence_transformers import SentenceTransformer
+            _model = SentenceTransformer(settings.embedding_model)
+    return _model
 
 def _to_np(vec_list):
     """Convert list of vectors to NumPy array."""
     return np.array(vec_list, dtype=np.float32)
 
-def _embed_texts(texts: List[str]) -> List[List[float]]:
-    """Generate embeddings for a list of text strings."""
-    return _model.encode(texts, normalize_embeddings=True).tolist()
+def _embed_texts(texts: List[str]) -> np.ndarray:
+    """Generate normalised embeddings (one row per text), locally or via the embedding service."""
+    if settings.embedding_service_address:
+        from app.utils.embedding_service import embed_remote
+        return embed_remote(texts)
+    return _get_model().encode(texts, normalize_embeddings=True).astype(np.float32)
+
+def _index_empty() -> bool:
+    return not _INDEX_METAS
 
 # -------------------------------------------------------------------
 # INDEX BUILDER
 # -------------------------------------------------------------------
-def build_index(force: bool = False):
+def _reflect(db_name: str) -> dict:
+    """Reflect one database inside its bulkhead, so slow or failing reflection feeds its breaker."""
+    session_gen = get_db_session(db_name)
+    db = next(session_gen)
+    try:
+        return get_bulkhead(db_name).call(get_dynamic_schema_text, db)
+    finally:
+        session_gen.close()  # closes the session and frees its bulkhead slot
+
+
+def _reflect_and_embed():
     """
-    Builds or refreshes an in-memory vector index from all database schemas.
-    Each DB and table is represented as a semantic vector.
+    Reflect every database and embed its schema. Returns (vectors, metas).
+    A database that is down, overloaded or behind an open circuit is left out of this build
+    instead of failing the whole index.
     """
-    global _VECTOR_INDEX, _LAST_INDEX_BUILD
-    refresh_databases() 
+    refresh_databases()
+    texts_to_embed, metas = [], []
 
-    with _INDEX_LOCK:
-        if not force and (time.time() - _LAST_INDEX_BUILD) < _INDEX_TTL and _VECTOR_INDEX:
-            return
+    for db_name in list(DATABASES.keys()):
+        try:
+            schema_info = _reflect(db_name)
+        except Exception as ex:
+            if not isinstance(ex, DatabaseUnavailable) and not is_health_failure(ex):
+                raise
+            print(f"[⚠️] Skipping {db_name} while indexing: {type(ex).__name__}: {ex}")
+            continue
+
+        text = schema_info.get("text", "").strip()
+        if not text:
+            continue
+
+        tables = schema_info.get("tables", {})
+
+        # Database-level summary
+        db_summary = (
+            f"Database: {db_name}. Contains tables related to: "
+            + ", ".join(list(tables)[:5])
+        )
+
+        texts_to_embed.append(db_summary)
+        metas.append({"db": db_name, "table": None, "text": db_summary})
+
+        # Add one snippet per table (the schema text lists all tables in a single block,
+        # so splitting it on blank lines gave one entry for the whole database)
+        for table_name, columns in tables.items():
+            contextual_block = f"Database: {db_name}. Table: {table_name} (Columns: {', '.join(columns)})"
+            texts_to_embed.append(contextual_block)
+            metas.append({"db": db_name, "table": table_name, "text": contextual_block, "columns": columns})
+
+    if not texts_to_embed:
+        return np.zeros((0, 0), dtype=np.float32), []
+    return _embed_texts(texts_to_embed), metas
+
+
+def _build_lexical(metas):
+    """Inverted index over identifier-split table + column names (table named twice to weight it)."""
+    entries, documents = [], []
+    for i, meta in enumerate(metas):
+        if not meta.get("table"):
+            continue
+        columns = meta.get("columns")
+        words = tokenize(meta["db"]) + tokenize(meta["table"]) * 2
+        words += tokenize(" ".join(columns)) if columns is not None else tokenize(meta["text"])
+        entries.append(i)
+        documents.append(words)
+    return BM25Index(documents), entries
 
-        print("\n[🔄] Building semantic index for all databases...")
-        texts_to_embed, metas = [], []
-
-        for db_name in DATABASES.keys():
-            session_gen = get_db_session(db_name)
-            db = next(session_gen)
-            try:
-                schema_info = get_dynamic_schema_text(db)
-                text = schema_info.get("text", "").strip()
-                if not text:
-                    continue
-
-                # Split schema into table-level blocks
-                blocks = text.split("\n\n")
-
-                # Database-level summary
-                related_tables = [
-                    b.split(":")[1].split("\n")[0].strip()
-                    for b in blocks if b.lower().startswith("table:")
-                ]
-                db_summary = (
-                    f"Database: {db_name}. Contains tables related to: "
-                    + ", ".join(related_tables[:5])
-                )
-
-                texts_to_embed.append(db_summary)
-                metas.append({"db": db_name, "table": None, "text": db_summary})
-
-                # Add table-level snippets
-                for block in blocks:
-                    if not block.strip():
-                        continue
-
-                    short_block = "\n".join(block.splitlines()[:8])
-                    first_line = block.splitlines()[0].lower()
-                    table_name = None
-                    if first_line.startswith("table:"):
-                        table_name = block.split(":")[1].split("\n")[0].strip()
-
-                    contextual_block = f"Database: {db_name}. {short_block}"
-                    texts_to_embed.append(contextual_block)
-                    metas.append({"db": db_name, "table": table_name, "text": contextual_block})
-
-            finally:
-                db.close()
-
-        if not texts_to_embed:
-            _VECTOR_INDEX = []
-            _LAST_INDEX_BUILD = time.time()
-            print("[⚠️] No schema text found for indexing.")
+
+def _install(vectors, metas, version=None):
+    global _INDEX_VECTORS, _INDEX_METAS, _LEXICAL, _LEXICAL_ENTRIES, _INDEX_VERSION, _LAST_INDEX_BUILD
+    lexical, entries = _build_lexical(metas)
+    _INDEX_VECTORS, _INDEX_METAS, _LEXICAL, _LEXICAL_ENTRIES, _INDEX_VERSION = vectors, metas, lexical, entries, version
+    _LAST_INDEX_BUILD = time.time()
+
+
+def _build_local(force: bool):
+    if not force and (time.time() - _LAST_INDEX_BUILD) < _INDEX_TTL and not _index_empty():
+        return
+
+    print("\n[🔄] Building semantic index for all databases...")
+    vectors, metas = _reflect_and_embed()
+    _install(vectors, metas)
+    if not metas:
+        print("[⚠️] No schema text found for indexing.")
+        return
+    indexed = {meta["db"] for meta in metas}
+    print(f"[✅] Semantic index built for {len(indexed)} of {len(DATABASES)} databases ({len(metas)} entries).")
+
+
+def _map_snapshot(snapshot_dir: str, version: str):
+    vectors, metas = index_snapshot.load_snapshot(snapshot_dir, version)
+    if any(meta["db"] not in DATABASES for meta in metas):
+        refresh_databases()  # the builder saw a database this worker hasn't connected to yet
+    _install(vectors, metas, version)
+
+
+def _build_shared(force: bool):
+    """
+    Snapshot mode: whichever process wins the build lock reflects + embeds and publishes a
+    new version; everyone else maps the current version read-only.
+    """
+    snapshot_dir = settings.index_snapshot_dir
+    version = index_snapshot.current_version(snapshot_dir)
+    fresh = version is not None and index_snapshot.version_age(version) < _INDEX_TTL
+
+    if not force and fresh:
+        if version != _INDEX_VERSION:
+            _map_snapshot(snapshot_dir, version)
+        return
+
+    with index_snapshot.build_lock(snapshot_dir) as acquired:
+        if acquired:
+            print("\n[🔄] Building shared semantic index snapshot...")
+            vectors, metas = _reflect_and_embed()
+            version = index_snapshot.write_snapshot(snapshot_dir, vectors, metas)
+            _map_snapshot(snapshot_dir, version)
+            print(f"[✅] Index snapshot {version} published ({len(metas)} entries).")
             return
 
-        embeddings = _embed_texts(texts_to_embed)
-        _VECTOR_INDEX = [
-            {"embedding": emb, "meta": metas[i]}
-            for i, emb in enumerate(embeddings)
-        ]
-        _LAST_INDEX_BUILD = time.time()
-        print(f"[✅] Semantic index built for {len(DATABASES)} databases ({len(_VECTOR_INDEX)} entries).")
+    # someone else is building: use what exists, or wait for their first version
+    deadline = time.time() + _SNAPSHOT_WAIT
+    while version is None and time.time() < deadline:
+        time.sleep(0.5)
+        version = index_snapshot.current_version(snapshot_dir)
+    if version is not None and version != _INDEX_VERSION:
+        _map_snapshot(snapshot_dir, version)
+
+
+def build_index(force: bool = False):
+    """
+    Builds or refreshes the vector index from all database schemas.
+    Each DB and table is represented as a semantic vector. With settings.index_snapshot_dir
+    the index is built by one process and shared with the others as a memory-mapped snapshot.
+    While one thread refreshes an existing index, other callers keep using the current one
+    rather than waiting behind the slowest database's reflection.
+    """
+    if not _INDEX_LOCK.acquire(blocking=force or _index_empty()):
+        return
+    try:
+        if settings.index_snapshot_dir:
+            _build_shared(force)
+        else:
+            _build_local(force)
+    finally:
+        _INDEX_LOCK.release()
 
 # -------------------------------------------------------------------
 # SELECTOR
 # -------------------------------------------------------------------
-def select_databases_by_embedding(query: str, top_k: int = 10, score_threshold: float = 0.70) -> List[str]:
+# Embedding cosine and BM25 coverage live on different scales, so each is mapped to [0, 1]
+# (negative cosine -> 0, BM25 normalised by the query's matchable weight) and blended:
+#   fused = (1 - w) * embedding + w * lexical
+# A database is selected when fused >= threshold and within relative_cutoff of the best one.
+# Calibrate w / threshold on a labelled query set: python benchmark.py --selector-eval labelled.jsonl --calibrate
+
+
+def score_databases(queries: List[str]) -> List[Dict[str, Dict[str, float]]]:
     """
-    Returns a ranked list of database names relevant to the given query
-    using semantic similarity between the query and schema embeddings.
+    Per query: {db: {"embedding": best cosine over its entries, "lexical": best BM25 over its tables}}.
+    All queries are embedded in a single model call.
     """
-    if (time.time() - _LAST_INDEX_BUILD) > _INDEX_TTL or not _VECTOR_INDEX:
-        build_index(force=True)
+    build_index()
+    vectors, metas, lexical, lexical_entries = _INDEX_VECTORS, _INDEX_METAS, _LEXICAL, _LEXICAL_ENTRIES
+    if not metas:
+        return [{} for _ in queries]
 
-    q_emb = _embed_texts([query])[0]
-    if not _VECTOR_INDEX:
-        print("[⚠️] No vector index available.")
-        return []
+    sims = _to_np(_embed_texts(queries)).reshape(len(queries), -1) @ vectors.T  # normalised vectors -> cosine
+    db_rows = {}
+    for i, meta in enumerate(metas):
+        db_rows.setdefault(meta["db"], []).append(i)
 
-    vectors = [entry["embedding"] for entry in _VECTOR_INDEX]
-    arr = _to_np(vectors)
-    q = np.array(q_emb).reshape(1, -1).astype(np.float32)
+    out = []
+    for q, query in enumerate(queries):
+        scores = {db: {"embedding": max(0.0, float(sims[q, rows].max())), "lexical": 0.0} for db, rows in db_rows.items()}
+        for doc, score in enumerate(lexical.scores(tokenize(query))):
+            entry = scores[metas[lexical_entries[doc]]["db"]]
+            entry["lexical"] = max(entry["lexical"], score)
+        out.append(scores)
+    return out
 
-    sims = cosine_similarity(q, arr)[0]
-    scored = [(sims[i], _VECTOR_INDEX[i]["meta"]) for i in range(len(sims))]
-    scored.sort(key=lambda x: x[0], reverse=True)
 
-    db_scores = {}
-    for score, meta in scored[:top_k]:
-        db = meta.get("db")
-        if db not in db_scores or score > db_scores[db]:
-            db_scores[db] = score
+def fuse_scores(scores: Dict[str, float], lexical_weight: float) -> float:
+    return (1 - lexical_weight) * scores["embedding"] + lexical_weight * scores["lexical"]
 
-    selected = [
-        db for db, sc in sorted(db_scores.items(), key=lambda t: t[1], reverse=True)
-        if sc >= score_threshold
-    ]
+
+def rank_databases(query: str, scores: Dict[str, Dict[str, float]], score_threshold: float = None,
+                   lexical_weight: float = None, relative_cutoff: float = None, fallback: int = 1,
+                   verbose: bool = True) -> List[str]:
+    """Turn one query's per-database scores into the ranked list of databases to query."""
+    score_threshold = settings.selector_threshold if score_threshold is None else score_threshold
+    lexical_weight = settings.selector_lexical_weight if lexical_weight is None else lexical_weight
+    relative_cutoff = settings.selector_relative_cutoff if relative_cutoff is None else relative_cutoff
+
+    fused = sorted(((fuse_scores(sc, lexical_weight), db) for db, sc in scores.items()), reverse=True)
+    if not fused:
+        return []
+    best = fused[0][0]
+    selected = [db for sc, db in fused if sc >= score_threshold and sc >= best * relative_cutoff]
 
     if not selected:
-        selected = [
-            db for db, _ in sorted(db_scores.items(), key=lambda t: t[1], reverse=True)
-        ][:2]
+        # nothing clears the bar: only the single best candidate, instead of fanning out
+        selected = [db for _, db in fused[:fallback]]
 
-    print(f"[🧠] Query: {query}\n[🎯] Selected DBs: {selected}")
+    if verbose:
+        detail = ", ".join(f"{db}={sc:.2f}" for sc, db in fused[:5])
+        print(f"[🧠] Query: {query}\n[🎯] Selected DBs: {selected} ({detail})")
     return selected
+
+
+def select_databases_by_embedding(query: str, score_threshold: float = None) -> List[str]:
+    """
+    Returns a ranked list of database names relevant to the given query, fusing semantic
+    similarity to the schema embeddings with BM25 matches on table and column names.
+    """
+    scores = score_databases([query])[0]
+    if not scores:
+        print("[⚠️] No vector index available.")
+        return []
+    return rank_databases(query, scores, score_threshold)
+
+
+def select_databases_by_embedding_batch(queries: List[str], score_threshold: float = None) -> List[List[str]]:
+    """
+    Batch version of select_databases_by_embedding.
+    All queries are embedded in a single model call; results keep the input order.
+    """
+    if not queries:
+        return []
+    all_scores = score_databases(queries)
+    if not all_scores[0]:
+        print("[⚠️] No vector index available.")
+        return [[] for _ in queries]
+    return [rank_databases(query, scores, score_threshold) for query, scores in zip(queries, all_scores)]
+
+
+def select_tables_by_embedding(query: str, db_names: List[str], per_db: int = 4) -> Dict[str, List[str]]:
+    """
+    Most relevant tables per database for a query, from the table-level index entries
+    (embedding and lexical scores fused the same way as for databases).
+    Used to prune the combined schema prompt for cross-database queries.
+    """
+    build_index()
+    vectors, metas, lexical, lexical_entries = _INDEX_VECTORS, _INDEX_METAS, _LEXICAL, _LEXICAL_ENTRIES
+    hits = {db: [] for db in db_names}
+    if not metas:
+        return hits
+
+    w = settings.selector_lexical_weight
+    fused = (1 - w) * np.clip(_to_np(_embed_texts([query])).reshape(1, -1) @ vectors.T, 0, None)[0]
+    for doc, score in enumerate(lexical.scores(tokenize(query))):
+        fused[lexical_entries[doc]] += w * score
+
+    for i in np.argsort(fused)[::-1]:
+        meta = metas[i]
+        db, table = meta.get("db"), meta.get("table")
+        if db in hits and table and len(hits[db]) < per_db:
+            hits[db].append(table)
+    return hits
@@ -0,0 +1,116 @@
+import atexit
+import hashlib
+import json
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from app.utils.config import settings
+
+# -------------------------------------------------------------------
+# STAGE TIMER
+# -------------------------------------------------------------------
+class StageTimer:
+    """Accumulates wall-clock milliseconds per pipeline stage."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.ms = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.ms[name] = round(self.ms.get(name, 0.0) + (time.perf_counter() - t0) * 1000, 1)
+
+    def total_ms(self) -> float:
+        return round((time.perf_counter() - self.started) * 1000, 1)
+
+
+def context_fingerprint(history) -> str:
+    """Short stable hash of the session history a question was asked with."""
+    return hashlib.sha256(json.dumps(history, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+# -------------------------------------------------------------------
+# APPEND-ONLY CAPTURE LOG (opt-in via settings.capture_path)
+# -------------------------------------------------------------------
+_QUEUE = queue.SimpleQueue()
+_WRITER = None
+_WRITER_LOCK = threading.Lock()
+
+
+def capture_enabled() -> bool:
+    return bool(settings.capture_path)
+
+
+def _writer_loop(path: str):
+    with open(path, "a", encoding="utf-8") as f:
+        while True:
+            item = _QUEUE.get()
+            if isinstance(item, threading.Event):  # flush() marker
+                f.flush()
+                item.set()
+                continue
+            f.write(item + "\n")
+            if _QUEUE.empty():
+                f.flush()
+
+
+def flush(timeout: float = 5.0):
+    """Block until everything queued so far is on disk."""
+    if _WRITER is None:
+        return
+    done = threading.Event()
+    _QUEUE.put(done)
+    done.wait(timeout)
+
+
+def record(entry: dict):
+    """Queue one JSON line for the capture log; the file write happens on a background thread."""
+    global _WRITER
+    if not capture_enabled():
+        return
+    if _WRITER is None:
+        with _WRITER_LOCK:
+            if _WRITER is None:
+                _WRITER = threading.Thread(target=_writer_loop, args=(settings.capture_path,), daemon=True)
+                _WRITER.start()
+                atexit.register(flush)
+    _QUEUE.put(json.dumps(entry, default=str))
+
+
+def capture_request(payload: dict, trace: dict, response: dict):
+    """Build the capture record for one /multi-db-query call from its trace and response."""
+    if not capture_enabled():
+        return
+    results = response.get("results") or {}
+    timer = trace["timer"]
+    record({
+        "ts": trace["ts"],
+        "question": payload.get("query", ""),
+        "session_id": response.get("session_id"),
+        "session_context": trace.get("context"),
+        "status": response.get("status"),
+        "selected_dbs": response.get("selected_databases", []),
+        "query_plan": response.get("query_plan"),
+        "sql": {name: res.get("generated_sql") for name, res in results.items()},
+        "row_counts": {name: res.get("rows_returned", 0) for name, res in results.items()},
+        "timings_ms": {**timer.ms, "total": timer.total_ms()},
+        "tokens": trace.get("tokens", {}),
+        "prompt_tokens": trace.get("prompt_tokens", {}),
+    })
+
+
+def load_capture(path: str):
+    """Read a capture log back as a list of records (skipping torn trailing lines)."""
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
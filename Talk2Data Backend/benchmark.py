@@ -0,0 +1,215 @@
+"""
+Throughput benchmark for a running Talk2Data backend.
+
+Compares answering a list of questions one call at a time against a single
+`/multi-db-query/batch` call. Both do the same work per question (database selection,
+SQL generation, execution): the sequential run posts one-question batches. `--mode pipeline`
+times the full `/multi-db-query` pipeline separately, which also plans cross-database
+queries and generates a conversational summary per question, so it isn't like-for-like.
+
+Usage:
+    python benchmark.py queries.txt --base-url http://127.0.0.1:8000 --mode both
+    python benchmark.py --profile-rows 1000000   # time the summary-prompt result profiler locally
+    python benchmark.py --selector-eval labelled.jsonl --calibrate   # database selection quality
+
+`queries.txt` holds one question per line (blank lines and lines starting with # are ignored).
+`labelled.jsonl` holds one {"query": "...", "dbs": ["fooddb"]} object per line: the databases that
+can actually answer the question. Selector evaluation runs in-process against the configured databases.
+"""
+import argparse
+import json
+import time
+import urllib.request
+
+
+def post_json(url: str, payload: dict, timeout: float = 600):
+    req = urllib.request.Request(
+        url,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        return json.loads(resp.read().decode("utf-8"))
+
+
+def load_queries(path: str):
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def post_batch(base_url: str, queries, max_concurrency=None):
+    """One /multi-db-query/batch call; returns the number of failed items."""
+    payload = {"queries": queries}
+    if max_concurrency:
+        payload["max_concurrency"] = max_concurrency
+    res = post_json(f"{base_url}/api/multi-db-query/batch", payload)
+    if res.get("status") != "success":
+        raise RuntimeError(res.get("message"))
+    return sum(1 for item in res["items"] if item["status"] == "error")
+
+
+def run_sequential(base_url: str, queries):
+    """One question per call, same work per question as the batch endpoint."""
+    started = time.perf_counter()
+    errors = sum(post_batch(base_url, [q]) for q in queries)
+    return time.perf_counter() - started, errors
+
+
+def run_batch(base_url: str, queries, max_concurrency=None):
+    started = time.perf_counter()
+    errors = post_batch(base_url, queries, max_concurrency)
+    return time.perf_counter() - started, errors
+
+
+def run_pipeline(base_url: str, queries):
+    """The full /multi-db-query pipeline per question (adds cross-database planning and a summary call)."""
+    started = time.perf_counter()
+    errors = 0
+    for q in queries:
+        res = post_json(f"{base_url}/api/multi-db-query", {"query": q})
+        if res.get("status") == "error":
+            errors += 1
+    return time.perf_counter() - started, errors
+
+
+def report(label: str, elapsed: float, errors: int, n: int):
+    print(f"{label:<12} {elapsed:8.2f}s  {n / elapsed:6.2f} q/s  errors: {errors}/{n}")
+
+
+def run_profile(n: int):
+    """Time profile_rows on a synthetic n-row result and show the digest it produces."""
+    from app.utils.result_profiler import profile_rows, digest_to_text
+
+    cities = ["Mumbai", "Pune", "Delhi", "Nagpur", "Bangalore"]
+    rows = [
+        {
+            "OrderID": i,
+            "City": cities[i % 5] if i % 50 else None,
+            "Amount": (i % 997) / 3,
+            "OrderDate": f"2024-{1 + i % 12:02d}-{1 + i % 28:02d}",
+            "CustomerName": f"customer{i % 5000}",
+        }
+        for i in range(n)
+    ]
+    columns = list(rows[0])
+    tuples = [tuple(row.values()) for row in rows]  # what SQLAlchemy hands back before any dicts are built
+
+    started = time.perf_counter()
+    digest = profile_rows(rows)
+    elapsed = time.perf_counter() - started
+    print(f"profile_rows (dict rows):  {n} rows x {len(columns)} columns in {elapsed:.3f}s")
+
+    started = time.perf_counter()
+    digest = profile_rows(tuples, columns=columns)
+    elapsed = time.perf_counter() - started
+    text = digest_to_text(digest)
+    print(f"profile_rows (row tuples): {n} rows x {len(columns)} columns in {elapsed:.3f}s, digest {len(text)} chars")
+    print(text)
+
+
+def load_labelled(path: str):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip() and not line.startswith("#")]
+
+
+def evaluate_selection(labelled, all_scores, **params):
+    """Wasted databases (selected but not labelled) and recall of labelled databases for one configuration."""
+    from app.utils.semantic_selector import rank_databases
+
+    selected_total = wasted = hits = gold_total = covered = 0
+    for item, scores in zip(labelled, all_scores):
+        gold = set(item["dbs"])
+        selected = set(rank_databases(item["query"], scores, verbose=False, **params))
+        selected_total += len(selected)
+        wasted += len(selected - gold)
+        hits += len(selected & gold)
+        gold_total += len(gold)
+        covered += gold <= selected
+    n = len(labelled)
+    return {
+        "dbs_per_query": selected_total / n,
+        "wasted_per_query": wasted / n,
+        "recall": hits / gold_total if gold_total else 1.0,
+        "fully_covered": covered / n,
+    }
+
+
+def report_selection(label: str, metrics: dict):
+    print(f"{label:<26} dbs/query {metrics['dbs_per_query']:5.2f}  wasted/query {metrics['wasted_per_query']:5.2f}  "
+          f"recall {metrics['recall']:6.1%}  fully covered {metrics['fully_covered']:6.1%}")
+
+
+def run_selector_eval(path: str, calibrate: bool, target_recall: float):
+    from app.utils.config import settings
+    from app.utils.semantic_selector import score_databases
+
+    labelled = load_labelled(path)
+    started = time.perf_counter()
+    all_scores = score_databases([item["query"] for item in labelled])
+    print(f"Scored {len(labelled)} labelled queries in {time.perf_counter() - started:.2f}s")
+
+    # the previous selector: embedding only, fixed 0.70 threshold, top-2 fallback
+    report_selection("embedding (0.70, top-2)", evaluate_selection(
+        labelled, all_scores, score_threshold=0.70, lexical_weight=0.0, relative_cutoff=0.0, fallback=2))
+    report_selection("hybrid (configured)", evaluate_selection(labelled, all_scores))
+    if not calibrate:
+        return
+
+    # grid search: fewest wasted databases among configurations that keep recall >= target
+    candidates = []
+    for w in [i / 10 for i in range(11)]:
+        for threshold in [0.2 + i * 0.05 for i in range(13)]:
+            for cutoff in (0.0, 0.6, 0.7, 0.8, 0.9):
+                params = {"score_threshold": threshold, "lexical_weight": w, "relative_cutoff": cutoff}
+                candidates.append((evaluate_selection(labelled, all_scores, **params), params))
+    eligible = [c for c in candidates if c[0]["recall"] >= target_recall] or candidates
+    current = (settings.selector_lexical_weight, settings.selector_threshold, settings.selector_relative_cutoff)
+    distance = lambda p: sum(abs(x - y) for x, y in zip((p["lexical_weight"], p["score_threshold"], p["relative_cutoff"]), current))
+    # ties are common on small sets: prefer the configuration closest to the current one
+    metrics, params = min(eligible, key=lambda c: (c[0]["wasted_per_query"], -c[0]["recall"], distance(c[1])))
+    report_selection("hybrid (calibrated)", metrics)
+    print("Suggested settings:")
+    print(f"  SELECTOR_LEXICAL_WEIGHT={params['lexical_weight']:.1f}  (current {settings.selector_lexical_weight})")
+    print(f"  SELECTOR_THRESHOLD={params['score_threshold']:.2f}  (current {settings.selector_threshold})")
+    print(f"  SELECTOR_RELATIVE_CUTOFF={params['relative_cutoff']:.1f}  (current {settings.selector_relative_cutoff})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Talk2Data throughput benchmark")
+    parser.add_argument("queries", nargs="?", help="file with one question per line")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--mode", choices=["sequential", "batch", "both", "pipeline"], default="both",
+                        help="both = sequential vs batch (equal work); pipeline = full /multi-db-query per question")
+    parser.add_argument("--max-concurrency", type=int, default=None)
+    parser.add_argument("--profile-rows", type=int, default=None, help="benchmark the result profiler instead")
+    parser.add_argument("--selector-eval", metavar="LABELLED", help="evaluate database selection on a labelled query set")
+    parser.add_argument("--calibrate", action="store_true", help="with --selector-eval: grid-search fusion weight and thresholds")
+    parser.add_argument("--target-recall", type=float, default=0.95, help="minimum recall accepted when calibrating")
+    args = parser.parse_args()
+
+    if args.profile_rows:
+        run_profile(args.profile_rows)
+        return
+    if args.selector_eval:
+        run_selector_eval(args.selector_eval, args.calibrate, args.target_recall)
+        return
+    if not args.queries:
+        parser.error("a queries file is required")
+
+    queries = load_queries(args.queries)
+    print(f"Benchmarking {len(queries)} queries against {args.base_url}")
+
+    if args.mode in ("sequential", "both"):
+        elapsed, errors = run_sequential(args.base_url, queries)
+        report("sequential", elapsed, errors, len(queries))
+    if args.mode in ("batch", "both"):
+        elapsed, errors = run_batch(args.base_url, queries, args.max_concurrency)
+        report("batch", elapsed, errors, len(queries))
+    if args.mode == "pipeline":
+        elapsed, errors = run_pipeline(args.base_url, queries)
+        report("pipeline", elapsed, errors, len(queries))
+
+
+if __name__ == "__main__":
+    main()
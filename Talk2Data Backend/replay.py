@@ -0,0 +1,185 @@
+"""
+Deterministic replay of a captured production workload.
+
+Feeds a capture log (written when CAPTURE_PATH is set) back through the /multi-db-query
+pipeline in-process, against local SQLite stand-ins for the databases and a stub LLM
+that returns the SQL recorded for each question. Arrival times are kept, optionally
+compressed with --speed, so latency distributions can be compared before/after a change.
+
+Usage:
+    python replay.py capture.jsonl --databases standins.json --speed 10 --out after.jsonl
+    python replay.py --compare before.jsonl after.jsonl
+
+`standins.json` maps database names to SQLAlchemy URLs, e.g. {"fooddb": "sqlite:///standins/fooddb.db"}.
+It replaces the configured databases entirely, and every database named in the log needs an entry.
+The LLM scheduler runs without rpm/tpm buckets (the stub answers instantly), so latencies
+reflect the pipeline rather than provider throttling.
+The run writes its own capture log (--out) so two runs can be compared stage by stage.
+Cross-database records replay as a single query on the first stand-in and usually fail on SQLite.
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import re
+import sys
+import time
+from types import SimpleNamespace
+
+STAGES = ["selection", "schema", "sql_generation", "execution", "summary", "total"]
+
+_CURRENT = contextvars.ContextVar("replay_record", default=None)  # index of the record being replayed
+
+
+# -------------------------------------------------------------------
+# STUB LLM
+# -------------------------------------------------------------------
+class RecordedLLM:
+    """
+    Drop-in for the OpenAI client used by the LLM scheduler.
+    SQL-generation prompts get the SQL of the record being replayed (by position, so a
+    question asked again in another session or after a schema change gets its own SQL);
+    everything else (the conversational summary) gets a fixed sentence. Token usage
+    mirrors the recording.
+    """
+
+    def __init__(self, records):
+        self.records = records
+        self.chat = SimpleNamespace(completions=self)
+
+    def _completion(self, content: str, tokens: int):
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(total_tokens=tokens, prompt_tokens=tokens, completion_tokens=0),
+        )
+
+    def create(self, model, messages, **kwargs):
+        # SQL prompts end with "User: {question}"; the session history before it may hold
+        # earlier questions, so only the final message identifies the one being asked
+        last = (messages[-1].get("content") or "").strip()
+        question = last[len("User: "):] if last.startswith("User: ") else None
+        db_match = re.search(r"Database: ([^\n]+)", messages[0].get("content") or "")
+        index = _CURRENT.get()
+        rec = self.records[index] if index is not None else {}
+        by_db = {db_name: sql for db_name, sql in (rec.get("sql") or {}).items() if sql}
+        if question != rec.get("question") or not by_db or db_match is None:
+            return self._completion("Here's a replayed summary of the data.", 0)
+
+        label = db_match.group(1).strip()
+        sql = by_db.get(label) or next(
+            (s for name, s in by_db.items() if name.lower() in label.lower()),
+            next(iter(by_db.values())),  # cross-database records hold a single query
+        )
+        return self._completion(sql, (rec.get("tokens") or {}).get("sql_generation", 0))
+
+
+# -------------------------------------------------------------------
+# REPLAY
+# -------------------------------------------------------------------
+async def replay(records, speed: float):
+    from app.api import multidb_routes
+    from app.utils.config import settings
+    from app.utils.llm_scheduler import LLMScheduler
+
+    records = sorted(records, key=lambda r: r["ts"])
+    # keep the configured concurrency caps but not the rpm/tpm buckets: they only model the provider
+    caps = {model: {"max_concurrency": limits["max_concurrency"]}
+            for model, limits in settings.llm_rate_limits.items() if "max_concurrency" in limits}
+    multidb_routes.llm = LLMScheduler(RecordedLLM(records), limits=caps, max_retries=0)
+    t0 = records[0]["ts"]
+    started = time.perf_counter()
+    latencies, errors = [], 0
+
+    async def run(index, rec):
+        nonlocal errors
+        _CURRENT.set(index)  # each record runs in its own task, so this is per request
+        if speed > 0:
+            delay = (rec["ts"] - t0) / speed - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        t = time.perf_counter()
+        res = await multidb_routes.multi_db_query({"query": rec["question"], "session_id": rec.get("session_id")})
+        latencies.append((time.perf_counter() - t) * 1000)
+        if res.get("status") == "error":
+            errors += 1
+
+    await asyncio.gather(*[run(i, rec) for i, rec in enumerate(records)])
+    return latencies, errors
+
+
+def percentiles(values):
+    if not values:
+        return {"n": 0}
+    values = sorted(values)
+    pick = lambda p: values[min(len(values) - 1, int(p * len(values)))]
+    return {"n": len(values), "p50": round(pick(0.50), 1), "p90": round(pick(0.90), 1),
+            "p99": round(pick(0.99), 1), "mean": round(sum(values) / len(values), 1)}
+
+
+def stage_distributions(records):
+    return {
+        stage: percentiles([r["timings_ms"][stage] for r in records if stage in (r.get("timings_ms") or {})])
+        for stage in STAGES
+    }
+
+
+def compare(before_path: str, after_path: str):
+    from app.utils.workload_capture import load_capture
+
+    before = stage_distributions(load_capture(before_path))
+    after = stage_distributions(load_capture(after_path))
+    print(f"{'stage':<16}{'before p50/p90/p99 (ms)':>30}{'after p50/p90/p99 (ms)':>30}")
+    for stage in STAGES:
+        b, a = before[stage], after[stage]
+        fmt = lambda d: f"{d['p50']}/{d['p90']}/{d['p99']}" if d["n"] else "-"
+        print(f"{stage:<16}{fmt(b):>30}{fmt(a):>30}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a Talk2Data capture log")
+    parser.add_argument("capture", nargs="?", help="capture log to replay")
+    parser.add_argument("--databases", help="JSON file mapping database names to stand-in URLs")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="pacing multiplier (1 = original arrival times, 10 = 10x faster, 0 = no pacing)")
+    parser.add_argument("--out", help="capture log to write for this run")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two capture logs")
+    args = parser.parse_args()
+    os.environ.setdefault("GROQ_API_KEY", "replay")  # the stub LLM never calls the real API
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if not args.capture or not args.databases:
+        parser.error("capture log and --databases are required")
+
+    with open(args.databases, encoding="utf-8") as f:
+        standins = json.load(f)
+    if args.out:
+        os.environ["CAPTURE_PATH"] = args.out
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    from app.utils.config import settings
+    from app.utils.workload_capture import flush, load_capture
+
+    records = [r for r in load_capture(args.capture) if r.get("question")]
+    if not records:
+        parser.error("capture log is empty")
+    logged = {db_name for r in records for db_name in [*(r.get("selected_dbs") or []), *(r.get("sql") or {})]}
+    missing = sorted(logged - set(standins))
+    if missing:
+        parser.error(f"no stand-in for {', '.join(missing)} in {args.databases}; refusing to touch real databases")
+
+    # Settings merge DATABASE_URLS from the environment with .env, so overriding the env var
+    # would leave real databases configured. Replace them outright before the engines are built.
+    settings.database_urls = standins
+    settings.database_url = settings.food_db_url = None
+
+    latencies, errors = asyncio.run(replay(records, args.speed))
+    flush()
+    print(f"Replayed {len(records)} requests ({errors} errors) at speed {args.speed}")
+    print("end-to-end latency (ms):", percentiles(latencies))
+
+
+if __name__ == "__main__":
+    main()